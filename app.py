@@ -1,15 +1,26 @@
-from openai import OpenAI, OpenAIError
-from flask import Flask, request, jsonify, make_response, send_file, session
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, request, jsonify, make_response, send_file
 import os
 from flask_cors import CORS
-import ssl
 import secrets
-import time
 import random
 from chat_utils import get_response
+from tts_utils import generate_tts_audio, voice_for_language
+from session_store import get_store, new_conversation
+from resilience_utils import UpstreamUnavailableError
 from email_utils import send_transcript # Import send_transcript from email_utils
 from config import Config
-import glob
+from clients import ensure_directories
+from speech_backends import get_transcriber
+from audio_preprocess import preprocess_for_transcription
+from search_index import get_search_index, vocabulary_terms
+from usage_utils import record_usage, get_usage_aggregator, GROUP_FIELDS
+from prompt_store import get_prompt_store, PromptConflictError, PromptNotFoundError, PromptExistsError
+from idempotency import idempotent, mark_state_written
+from storage import get_storage, update_json, open_for_send, history_key, audio_key, HISTORY_PREFIX, AUDIO_PREFIX, SUBMISSIONS_KEY
+import tempfile
 from datetime import datetime, timedelta
 import json
 import sys
@@ -20,41 +31,13 @@ import grp # For getting group name from GID
 # Define the absolute path to the project's root directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Validate configuration on startup
-Config.validate_required_configs()
-
-
-client = OpenAI(api_key=Config.OPENAI_API_KEY)
-
 app = Flask(__name__)
 CORS(app, origins="*")
 app.secret_key = Config.SECRET_KEY
 app.config['SESSION_COOKIE_SECURE'] = True 
 
-# Use the BASE_DIR to define the path to files written to by the app
-PROMPT_FILE = os.path.join(BASE_DIR, 'AIPrompt.json')
-SAVE_DIRECTORY = os.path.join(BASE_DIR, "audio_files")
-DATA_FILE = os.path.join(BASE_DIR, "submissions.json")
-
-
-# Create necessary directories
-for directory in [SAVE_DIRECTORY, Config.CHAT_HISTORY_DIR]:
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-# SSL context setup
-context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-context.load_cert_chain(Config.CERT_FILE, Config.KEY_FILE, password=Config.SSL_KEY_PASSWORD)
-
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+# Create necessary directories on the first request rather than at import time
+app.before_request(ensure_directories)
 
 
 
@@ -62,16 +45,49 @@ def generate_user_token():
     """Generate a unique user token"""
     return str(secrets.token_hex(16))
 
+def load_conversation(user_token, selectedChatbot, language):
+    """
+    Get the server-side conversation record for a turn, starting one if needed.
+    The chatbot prompt is cached on the record and only looked up again when the
+    chatbot changes or the prompt revision has moved on.
+    Returns None if the chatbot does not exist.
+    """
+    conversation = get_store().get(user_token)
+    if conversation is None:
+        conversation = new_conversation()
+
+    prompt_version = get_prompt_store().revision()
+
+    if (conversation["chatbot"] != selectedChatbot
+            or conversation["prompt"] is None
+            or conversation["prompt_version"] != prompt_version):
+        prompt_file = load_prompts()
+        if selectedChatbot not in prompt_file:
+            return None
+        conversation["chatbot"] = selectedChatbot
+        conversation["prompt"] = prompt_file[selectedChatbot]['prompt']
+        conversation["prompt_version"] = prompt_version
+
+    conversation["language"] = language
+    return conversation
+
+def start_new_conversation():
+    """Create a token with an empty server-side conversation record."""
+    user_token = generate_user_token()
+    conversation = new_conversation()
+    conversation["recent_lines"] = []  # Nothing to read from disk for a brand new token
+    get_store().set(user_token, conversation)
+    return user_token
+
 def get_conversation_context(user_token, limit=25):
     """Get conversation history from the unified chat history file format for display purposes"""
-    conversation_file = os.path.join(Config.CHAT_HISTORY_DIR, f"chat_history{user_token}.txt")
+    data = get_storage().read(history_key(user_token))
     
-    if not os.path.exists(conversation_file):
+    if data is None:
         return []
     
     try:
-        with open(conversation_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        lines = data.decode('utf-8').splitlines(keepends=True)
         
         # Parse conversations from the unified format
         conversations = []
@@ -103,41 +119,19 @@ def get_conversation_context(user_token, limit=25):
         print(f"Error reading conversation file: {e}")
         return []
 
-def generate_tts_audio(text, voice="alloy"):
-    """Generate TTS audio using OpenAI's TTS API."""
-    try:
-        timestamp = int(time.time())
-        random_num = random.randint(1000, 9999)
-        audio_filename = f"tts_{timestamp}_{random_num}.mp3"
-        audio_filepath = os.path.join(SAVE_DIRECTORY, audio_filename)
-        
-        
-        with client.audio.speech.with_streaming_response.create(
-            model="tts-1",
-            voice=voice,
-            input=text
-        ) as response:
-            response.stream_to_file(audio_filepath)
-        
-        if os.path.exists(audio_filepath):
-            return audio_filename
-        return None
-    except Exception as e:
-        print(f"ERROR TTS: {str(e)}")
-        return None
-
 @app.route('/tts', methods=['POST'])
 def text_to_speech():
     """Convert text to speech using OpenAI's TTS API."""
     try:
         data = request.get_json()
         text = data.get('text', '')
-        voice = data.get('voice', 'alloy')
+        # An explicit voice wins; otherwise use the voice configured for the chatbot's language
+        voice = data.get('voice') or voice_for_language(data.get('language'))
         
         if not text:
             return jsonify({'error': 'Text is required'}), 400
         
-        audio_filename = generate_tts_audio(text, voice)
+        audio_filename = generate_tts_audio(text, voice, data.get('language'))
         if audio_filename:
             return jsonify({
                 'success': True,
@@ -153,9 +147,10 @@ def text_to_speech():
 def serve_audio(filename):
     """Serve audio file."""
     try:
-        filepath = os.path.join(SAVE_DIRECTORY, filename)
-        if os.path.exists(filepath):
-            return send_file(filepath, as_attachment=False, mimetype="audio/mpeg")
+        source = open_for_send(get_storage(), audio_key(filename))
+        if source is not None:
+            mimetype = "audio/wav" if filename.endswith(".wav") else "audio/mpeg"
+            return send_file(source, as_attachment=False, mimetype=mimetype, download_name=filename)
         return jsonify({'error': 'Audio file not found'}), 404
     except Exception as e:
         print(f"ERROR AUDIO: {str(e)}")
@@ -165,8 +160,7 @@ def serve_audio(filename):
 def start_conversation():
     """Start a new conversation and return a unique token"""
     try:
-        user_token = generate_user_token()
-        session['user_token'] = user_token
+        user_token = start_new_conversation()
         return jsonify({
             'user_token': user_token,
             'message': 'New conversation started'
@@ -176,6 +170,7 @@ def start_conversation():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get_response', methods=['POST'])
+@idempotent
 def get_openai_response():
     """Get text response from OpenAI with conversation history."""
     try:
@@ -184,44 +179,42 @@ def get_openai_response():
         selectedChatbot = data.get('selectedChatbot', '')
         user_token = data.get('user_token')
         if not user_token: # If token not provided, generate a new one
-            user_token = generate_user_token()
-            session['user_token'] = user_token
+            user_token = start_new_conversation()
         user_name = data.get('user_name', 'Student')
         language = data.get('language', 'English')
         
         if not message:
             return jsonify({'error': 'Message is required'}), 400
 
-        prompt_file = load_prompts()
-        if selectedChatbot not in prompt_file:
+        conversation = load_conversation(user_token, selectedChatbot, language)
+        if conversation is None:
             return jsonify({'error': f"Chatbot '{selectedChatbot}' not found."}), 404
 
-        # Get the original prompt - chat_utils will handle adding history context
-        original_prompt = prompt_file[selectedChatbot]['prompt']
-
         # Get response - chat_utils handles conversation history automatically
         response = get_response(
             userText=message,
             user_name=user_name,
-            user_prompt=original_prompt,
+            user_prompt=conversation['prompt'],
             user_token=user_token,
-            language=language
+            language=language,
+            conversation=conversation
         )
         print(f'Using language {language} to get openAI response')
 
-        # Get conversation context for display purposes only
-        conversation_context = get_conversation_context(user_token, limit=25)
-
         return jsonify({
             'response': response, 
             'user_token': user_token,
-            'conversation_length': len(conversation_context)
+            'conversation_length': min(conversation['turns'], 25)
         })
+    except UpstreamUnavailableError as e:
+        print(f"Upstream unavailable in get_response: {str(e)}")
+        return jsonify({'error': 'The language model is temporarily unavailable. Please try again.'}), 503
     except Exception as e:
         print(f"Error in get_response: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/whisper', methods=['POST'])
+@idempotent
 def handle_voice_and_get_response():
     """Process audio input and get response with conversation history."""
     results = []
@@ -233,57 +226,72 @@ def handle_voice_and_get_response():
 
     # Generate token if not provided
     if not user_token:
-        user_token = generate_user_token()
-        session['user_token'] = user_token
+        user_token = start_new_conversation()
 
     if not selectedChatbot:
         return jsonify({'error': 'No chatbot selected.'}), 400
 
-    prompt_file = load_prompts()
-    if selectedChatbot not in prompt_file:
+    conversation = load_conversation(user_token, selectedChatbot, language)
+    if conversation is None:
         return jsonify({'error': f"Chatbot '{selectedChatbot}' not found."}), 404
 
     for filename, handle in request.files.items():
         file_name_random = f"{time.time()}_{random.randint(1,1000)}.mp3"
-        file_path = os.path.join(SAVE_DIRECTORY, file_name_random)
+        # Work on a local copy; the recording itself is kept in shared storage
+        file_path = os.path.join(tempfile.gettempdir(), file_name_random)
+        preprocessed = None
         try:
             handle.save(file_path)
-            with open(file_path, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language=language_code
-                )
-                transcript = transcription.text
-                print(f"Using language {language_code} for whisper")
-
-
-                # Get the original prompt - chat_utils will handle adding history context
-                original_prompt = prompt_file[selectedChatbot]['prompt']
-
-                # Get response - chat_utils handles conversation history automatically
-                response = get_response(
-                    userText=transcript,
-                    user_name=user_name,
-                    user_prompt=original_prompt,
-                    user_token=user_token,
-                    language=language
-                )
-                print(f"Using language {language} for whisper")
-
-                # Get conversation context for display purposes only
-                conversation_context = get_conversation_context(user_token, limit=25)
-
-                results.append({
-                    'filename': file_name_random,
-                    'transcript': transcript,
-                    'openai_response': {'response': response},
-                    'user_token': user_token,
-                    'conversation_length': len(conversation_context)
-                })
+            get_storage().save_file(audio_key(file_name_random), file_path)
+
+            # Trim silence and shrink the recording before it is uploaded for transcription
+            preprocessed = preprocess_for_transcription(file_path)
+            transcribe_path = file_path
+            preprocessing = None
+            if preprocessed:
+                transcribe_path = preprocessed.path
+                preprocessing = preprocessed.report()
+                print(f"Audio preprocessing saved {preprocessing['bytes_saved']} bytes, {preprocessing['seconds_saved']}s")
+
+            transcriber = get_transcriber(language)
+            started = time.monotonic()
+            transcript, audio_seconds = transcriber.transcribe(transcribe_path, language_code)
+            record_usage(
+                "transcription", transcriber.transcription_model, chatbot=selectedChatbot, language=language,
+                latency_ms=round((time.monotonic() - started) * 1000),
+                audio_seconds=round(audio_seconds, 2) if audio_seconds is not None else None,
+            )
+            print(f"Using language {language_code} for whisper")
+
+            # Get response - chat_utils handles conversation history automatically
+            response = get_response(
+                userText=transcript,
+                user_name=user_name,
+                user_prompt=conversation['prompt'],
+                user_token=user_token,
+                language=language,
+                conversation=conversation
+            )
+            print(f"Using language {language} for whisper")
+
+            results.append({
+                'filename': file_name_random,
+                'transcript': transcript,
+                'openai_response': {'response': response},
+                'user_token': user_token,
+                'conversation_length': min(conversation['turns'], 25),
+                'preprocessing': preprocessing
+            })
+        except UpstreamUnavailableError as e:
+            print(f"Upstream unavailable in whisper: {str(e)}")
+            return jsonify({'error': 'The language model is temporarily unavailable. Please try again.'}), 503
         except Exception as e:
             print(f"Error in whisper: {str(e)}")
             return jsonify({'error': str(e)}), 500
+        finally:
+            for path in [file_path, preprocessed.path if preprocessed else None]:
+                if path and os.path.exists(path):
+                    os.remove(path)
 
     return jsonify(results)
 
@@ -312,10 +320,9 @@ def clear_conversation():
         if not user_token:
             return jsonify({'error': 'User token is required'}), 400
         
-        # Use the same file path as chat_utils
-        conversation_file = os.path.join(Config.CHAT_HISTORY_DIR, f"chat_history{user_token}.txt")
-        if os.path.exists(conversation_file):
-            os.remove(conversation_file)
+        # Use the same storage key as chat_utils
+        get_storage().delete(history_key(user_token))
+        get_store().delete(user_token)
         
         return jsonify({'message': 'Conversation history cleared'})
     except Exception as e:
@@ -323,6 +330,7 @@ def clear_conversation():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/send_transcript', methods=['POST'])
+@idempotent
 def send_transcript_to_professor():
     """Send conversation transcript to professor."""
 
@@ -346,31 +354,35 @@ def send_transcript_to_professor():
         if not user_token or not professor_email:
             return jsonify({'error': 'User token and professor email are required'}), 400
 
-        # Save submission
-        submissions = load_submissions()
         prof_key = professor_email.lower()
         student_key = student_email.lower()  
 
-        if prof_key not in submissions:
-            submissions[prof_key] = {"students": {}}
-
-        if student_key not in submissions[prof_key]["students"]:
-            submissions[prof_key]["students"][student_key] = []
-
-
         conversation_context = get_conversation_context(user_token, limit=100)
 
         # Save the full conversation in submission.json
-        submissions[prof_key]["students"][student_key].append({
+        record = {
             "name": student_name,
             "email": student_key,  
             "chatbot_name": chatbot_name,
             "timestamp": current_datetime,
             "user_token": user_token,
             "conversation": conversation_context
-        })
+        }
 
-        save_submissions(submissions)
+        # Save submission; re-read and retry if another server saved one at the same time
+        def add_record(submissions):
+            students = submissions.setdefault(prof_key, {"students": {}})["students"]
+            students.setdefault(student_key, []).append(record)
+
+        update_json(get_storage(), SUBMISSIONS_KEY, add_record)
+        # From here on a retry must replay this response rather than save the submission again
+        mark_state_written()
+
+        # Index the conversation for professor search; a failure here must not block the submission
+        try:
+            get_search_index().add_submission(prof_key, student_key, record)
+        except Exception as e:
+            print(f"Error indexing submission: {str(e)}")
 
         response, status_code = send_transcript(
             user_token=user_token,
@@ -390,41 +402,43 @@ def send_transcript_to_professor():
         return jsonify({'error': str(e)}), 500
 
 def load_prompts():
-    """Load chatbot configurations from the prompts.json file."""
-    try:
-        with open(PROMPT_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Return an empty dictionary if the file doesn't exist or is empty/corrupt
-        return {}
+    """Load chatbot configurations from the prompts.json file.
+    Cached per process and refreshed only when the prompt revision changes; treat as read-only."""
+    return get_prompt_store().load()[0]
+
+def prompt_entry_from_request(data):
+    return {
+        "name": data.get("name"),
+        "language": data.get("language"),
+        "level": data.get("level"),
+        "initialText": data.get("initialText"),
+        "prompt": data.get("prompt") # Multi-line prompts are handled automatically
+    }
+
+def prompt_conflict_response(e):
+    return jsonify({
+        'error': 'This prompt was changed by someone else. Reload the prompts and try again.',
+        'revision': e.current_revision
+    }), 409
 
 @app.route('/update_prompt', methods=['POST'])
 def update_prompt():
-    """Update an existing prompt in the prompts.json file."""
+    """Update an existing prompt in the prompts.json file.
+    If `revision` is sent, the update only applies if nobody changed the prompts since."""
     try:
         data = request.get_json()
         title_to_update = data.get('title')
         if not title_to_update:
             return jsonify({'error': 'Title is required'}), 400
 
-        prompts = load_prompts()
-        if title_to_update not in prompts:
-            return jsonify({'error': 'Prompt not found'}), 404
-
-        # Update the entry with the new data from the form
-        prompts[title_to_update] = {
-            "name": data.get("name"),
-            "language": data.get("language"),
-            "level": data.get("level"),
-            "initialText": data.get("initialText"),
-            "prompt": data.get("prompt") # Multi-line prompts are handled automatically
-        }
-
-        # Write the entire updated dictionary back to the file
-        with open(PROMPT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(prompts, f, ensure_ascii=False, indent=2)
-
-        return jsonify({'message': 'Prompt updated successfully.'})
+        revision = get_prompt_store().update(
+            title_to_update, prompt_entry_from_request(data), expected_revision=data.get('revision')
+        )
+        return jsonify({'message': 'Prompt updated successfully.', 'revision': revision})
+    except PromptNotFoundError:
+        return jsonify({'error': 'Prompt not found'}), 404
+    except PromptConflictError as e:
+        return prompt_conflict_response(e)
     except Exception as e:
         print(f"Error in update_prompt: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -438,24 +452,14 @@ def save_prompt():
         if not title:
             return jsonify({'error': 'Title is required'}), 400
 
-        prompts = load_prompts()
-        if title in prompts:
-            return jsonify({'error': 'A prompt with this title already exists.'}), 409
-
-        # Add a new entry to the dictionary
-        prompts[title] = {
-            "name": data.get("name"),
-            "language": data.get("language"),
-            "level": data.get("level"),
-            "initialText": data.get("initialText"),
-            "prompt": data.get("prompt") # Multi-line prompts are handled automatically
-        }
-
-        # Write the entire updated dictionary back to the file
-        with open(PROMPT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(prompts, f, ensure_ascii=False, indent=2)
-
-        return jsonify({'message': 'Prompt saved successfully.'})
+        revision = get_prompt_store().create(
+            title, prompt_entry_from_request(data), expected_revision=data.get('revision')
+        )
+        return jsonify({'message': 'Prompt saved successfully.', 'revision': revision})
+    except PromptExistsError:
+        return jsonify({'error': 'A prompt with this title already exists.'}), 409
+    except PromptConflictError as e:
+        return prompt_conflict_response(e)
     except Exception as e:
         print(f"Error in save_prompt: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -470,69 +474,77 @@ def delete_prompt():
             print("DELETE PROMPT FUNCTION: Error - Prompt name not provided.")
             return jsonify({'success': False, 'message': 'Prompt name not provided'}), 400
 
-        
-        prompts = {}
-
-        if os.path.exists(PROMPT_FILE):
-            with open(PROMPT_FILE, 'r', encoding='utf-8') as f:
-                prompts = json.load(f)
-        else:
-            print(f"DELETE PROMPT FUNCTION: File not found at path: {PROMPT_FILE}")
-
-        if prompt_name_to_delete in prompts:
-            del prompts[prompt_name_to_delete]
-            with open(PROMPT_FILE, 'w', encoding='utf-8') as f:
-                json.dump(prompts, f, indent=4, ensure_ascii=False)
-            return jsonify({'success': True, 'message': f'Prompt "{prompt_name_to_delete}" deleted successfully'})
-        else:
-            return jsonify({'success': False, 'message': f'Prompt "{prompt_name_to_delete}" not found'}), 404
+        revision = get_prompt_store().delete(prompt_name_to_delete, expected_revision=data.get('revision'))
+        return jsonify({
+            'success': True,
+            'message': f'Prompt "{prompt_name_to_delete}" deleted successfully',
+            'revision': revision
+        })
 
+    except PromptNotFoundError:
+        return jsonify({'success': False, 'message': f'Prompt "{prompt_name_to_delete}" not found'}), 404
+    except PromptConflictError as e:
+        return jsonify({
+            'success': False,
+            'message': 'The prompts were changed by someone else. Reload and try again.',
+            'revision': e.current_revision
+        }), 409
     except Exception as e:
         # app.logger.error is a good practice, but print is better for direct console output in this case.
         print(f"DELETE PROMPT FUNCTION: ERROR - An exception occurred: {e}")
         return jsonify({'success': False, 'message': 'Internal server error'}), 500  
 
+@app.route('/prompt_changes', methods=['GET'])
+def get_prompt_changes():
+    """Change feed for AIPrompt.json: every change after the `since` revision."""
+    try:
+        since = request.args.get('since', 0, type=int)
+        store = get_prompt_store()
+        return jsonify({'revision': store.revision(), 'changes': store.changes_since(since)})
+    except Exception as e:
+        print(f"Error in get_prompt_changes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/data', methods=['GET'])
 def get_data():
     """Send chatbot configurations to frontend."""
     try:
-        data = load_prompts()
-        return jsonify(data)
+        data, revision = get_prompt_store().load()
+        etag = f'"prompts-{revision}"'
+        if request.headers.get('If-None-Match') == etag:
+            return '', 304
+        response = jsonify(data)
+        response.headers['ETag'] = etag
+        response.headers['X-Prompt-Revision'] = str(revision)
+        return response
     except Exception as e:
         print(f"Error in get_data: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def cleanup_old_files(directory, days=180):
-    """Delete files older than specified days in the given directory."""
-    if not os.path.exists(directory):
-        return
+def cleanup_old_files(prefix, days=180):
+    """Delete stored files older than specified days under the given storage prefix."""
+    storage = get_storage()
     cutoff = datetime.now() - timedelta(days=days)
-    for file in glob.glob(os.path.join(directory, '*')):
+    for key, modified in storage.list(prefix):
         try:
-            if os.path.getmtime(file) < cutoff.timestamp():
-                os.remove(file)
+            if modified < cutoff.timestamp():
+                storage.delete(key)
         except OSError:
             pass  # File might be in use or already deleted
 
 def load_submissions():
-    if not os.path.exists(Config.SUBMISSION_FILE):
+    data = get_storage().read(SUBMISSIONS_KEY)
+    if not data:
         return {}
     
     # Use a try-except block to handle an empty file, which is also a valid JSONDecodeError
     try:
-        with open(Config.SUBMISSION_FILE, 'r', encoding='utf-8') as f:
-            # Load the file into a variable and return that variable
-            submissions = json.load(f)
-            return submissions
+        return json.loads(data)
     except json.JSONDecodeError:
         # This can happen if the file is empty or corrupted.
         # Returning an empty dict is the correct action.
         return {}
 
-def save_submissions(data):
-    with open(Config.SUBMISSION_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
-
 @app.route('/professor/students', methods=['GET'])
 def get_students_for_professor():
     professor_email = request.args.get('email')
@@ -590,15 +602,67 @@ def get_student_conversation():
             })
     return jsonify({'error': 'Chatbot not found for this student'}), 404
 
+@app.route('/professor/search', methods=['GET'])
+def search_conversations():
+    """Full-text search over a professor's submitted conversations.
+    Pass one or more `q` terms, and/or `vocabulary=1` with `chatbot_name` to search
+    for the words in that chatbot's "Vocabulary to Integrate" list."""
+    try:
+        professor_email = request.args.get('email')
+        if not professor_email:
+            return jsonify({'error': 'Professor email is required'}), 400
+
+        chatbot_name = request.args.get('chatbot_name')
+        role = request.args.get('role')  # 'user' or 'assistant' to search one side only
+        terms = [term for term in request.args.getlist('q') if term.strip()]
+        if request.args.get('vocabulary') and chatbot_name:
+            prompts = load_prompts()
+            if chatbot_name in prompts:
+                terms.extend(vocabulary_terms(prompts[chatbot_name].get('prompt')))
+        if not terms:
+            return jsonify({'error': 'A search term is required'}), 400
+
+        index = get_search_index()
+        if not index.is_backfilled():
+            # First search after deploy: backfill from the existing submissions
+            index.add_all(load_submissions())
+            index.mark_backfilled()
+
+        limit = min(request.args.get('limit', 50, type=int), 200)
+        results = index.search(professor_email, terms, chatbot_name=chatbot_name, role=role, limit=limit)
+        return jsonify({'terms': terms, 'results': results, 'total': len(results)})
+    except Exception as e:
+        print(f"Error in search_conversations: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/usage', methods=['GET'])
+def get_usage():
+    """Aggregated upstream usage. Optional: start/end (YYYY-MM-DD) and
+    group_by, a comma-separated subset of day, kind, model, chatbot, language."""
+    try:
+        group_by = [field for field in request.args.get('group_by', 'day,kind,model').split(',') if field]
+        unknown = [field for field in group_by if field not in GROUP_FIELDS]
+        if unknown:
+            return jsonify({'error': f"Unknown group_by fields: {', '.join(unknown)}"}), 400
+
+        rows = get_usage_aggregator().query(group_by, request.args.get('start'), request.args.get('end'))
+        return jsonify({'group_by': group_by, 'usage': rows})
+    except Exception as e:
+        print(f"Error in get_usage: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+print(f"app.py imported in {(time.perf_counter() - _import_started) * 1000:.0f} ms", file=sys.stderr)
+
 # This block will only run when you execute `python app.py` directly
 # It will NOT run when the application is loaded by a WSGI server like Apache/mod_wsgi
 if __name__ == '__main__':
     # Can keep cleanup tasks here if you want to run them manually. Won't run with WSGI
-    cleanup_old_files(SAVE_DIRECTORY)
-    cleanup_old_files(Config.CHAT_HISTORY_DIR)
+    cleanup_old_files(AUDIO_PREFIX)
+    cleanup_old_files(HISTORY_PREFIX)
     
     # The app.run() part is for development only and should not be used in production
     print("This script is not intended to be run directly in production.")
     print(f"For development, run with a WSGI server like gunicorn, or use 'flask run'.")
     # For development with SSL, you might run it like this:
-    # app.run(ssl_context=context, host=Config.HOST, port=Config.PORT, debug=False)
+    # from clients import get_ssl_context
+    # app.run(ssl_context=get_ssl_context(), host=Config.HOST, port=Config.PORT, debug=False)
@@ -0,0 +1,150 @@
+import os
+import shutil
+import subprocess
+import wave
+from config import Config
+
+try:
+    import numpy as np
+except ImportError:  # Preprocessing is skipped when numpy is not installed
+    np = None
+
+TARGET_RATE = 16000
+FRAME_SECONDS = 0.03
+PAD_SECONDS = 0.2
+DECODE_RATE = 48000
+
+
+class PreprocessResult:
+    """Outcome of preprocessing one recording. `path` is the file to transcribe."""
+
+    def __init__(self, path, original_bytes, processed_bytes, original_seconds, processed_seconds):
+        self.path = path
+        self.original_bytes = original_bytes
+        self.processed_bytes = processed_bytes
+        self.original_seconds = original_seconds
+        self.processed_seconds = processed_seconds
+
+    def report(self):
+        return {
+            'bytes_saved': self.original_bytes - self.processed_bytes,
+            'seconds_saved': round(self.original_seconds - self.processed_seconds, 2),
+            'original_bytes': self.original_bytes,
+            'processed_bytes': self.processed_bytes,
+        }
+
+
+def _decode(path):
+    """Decode any browser recording to a float32 array of shape (samples, channels) and its rate."""
+    if shutil.which("ffmpeg"):
+        raw = subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", path, "-f", "f32le", "-ac", "2", "-ar", str(DECODE_RATE), "-"],
+            check=True, capture_output=True,
+        ).stdout
+        return np.frombuffer(raw, dtype=np.float32).reshape(-1, 2), DECODE_RATE
+
+    # Without ffmpeg only PCM WAV can be read
+    with wave.open(path, "rb") as w:
+        if w.getsampwidth() != 2:
+            raise ValueError("only 16-bit WAV is supported without ffmpeg")
+        channels, rate = w.getnchannels(), w.getframerate()
+        pcm = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+    return pcm.reshape(-1, channels).astype(np.float32) / 32768.0, rate
+
+
+def _to_mono_16k(samples, rate):
+    """Downmix and resample to 16 kHz with a windowed-sinc low-pass filter."""
+    mono = samples.mean(axis=1)
+    if rate == TARGET_RATE:
+        return mono
+
+    # Low-pass below the new Nyquist frequency to avoid aliasing
+    cutoff = 0.45 * TARGET_RATE / rate
+    taps = np.arange(-64, 65)
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+    filtered = np.convolve(mono, kernel / kernel.sum(), mode="same")
+
+    if rate % TARGET_RATE == 0:
+        return filtered[::rate // TARGET_RATE]
+    positions = np.arange(0, len(filtered), rate / TARGET_RATE)
+    return np.interp(positions, np.arange(len(filtered)), filtered)
+
+
+def _trim_silence(audio):
+    """
+    Energy-based voice activity detection: drop leading and trailing frames that
+    sit near the recording's noise floor, keeping a little padding around speech.
+    """
+    frame = int(TARGET_RATE * FRAME_SECONDS)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return audio
+
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    threshold = max(np.percentile(energy_db, 10) + 10, -55)
+    voiced = np.flatnonzero(energy_db > threshold)
+    if len(voiced) == 0:
+        # Nothing that looks like speech; leave the audio alone rather than send silence
+        return audio
+
+    pad = int(PAD_SECONDS / FRAME_SECONDS)
+    start = max(voiced[0] - pad, 0) * frame
+    end = min((voiced[-1] + 1 + pad) * frame, len(audio))
+    return audio[start:end]
+
+
+def _normalize(audio):
+    """Peak-normalize to -1 dBFS."""
+    peak = np.max(np.abs(audio)) if len(audio) else 0
+    if peak < 1e-4:
+        return audio
+    return audio * (0.89 / peak)
+
+
+def _encode(audio, base_path):
+    """Write 16 kHz mono audio as Opus when ffmpeg is available, otherwise as 16-bit WAV."""
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2").tobytes()
+    if shutil.which("ffmpeg"):
+        out_path = base_path + ".ogg"
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-f", "s16le", "-ar", str(TARGET_RATE), "-ac", "1", "-i", "-",
+             "-c:a", "libopus", "-b:a", "24k", "-application", "voip", out_path],
+            input=pcm, check=True, capture_output=True,
+        )
+        return out_path
+
+    out_path = base_path + ".wav"
+    with wave.open(out_path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(TARGET_RATE)
+        w.writeframes(pcm)
+    return out_path
+
+
+def preprocess_for_transcription(path):
+    """
+    Trim silence, downmix to mono, resample to 16 kHz, normalize and re-encode a
+    recording before it is sent for transcription.
+    Returns a PreprocessResult, or None if the original file should be used as is.
+    """
+    if not Config.PREPROCESS_AUDIO or np is None:
+        return None
+    try:
+        original_bytes = os.path.getsize(path)
+        samples, rate = _decode(path)
+        original_seconds = len(samples) / rate
+
+        audio = _normalize(_trim_silence(_to_mono_16k(samples, rate)))
+        out_path = _encode(audio, os.path.splitext(path)[0] + "_16k")
+
+        processed_bytes = os.path.getsize(out_path)
+        if processed_bytes >= original_bytes and len(audio) / TARGET_RATE >= original_seconds:
+            # No gain; transcribe the original
+            os.remove(out_path)
+            return None
+        return PreprocessResult(out_path, original_bytes, processed_bytes, original_seconds, len(audio) / TARGET_RATE)
+    except Exception as e:
+        print(f"Audio preprocessing skipped: {e}")
+        return None
@@ -1,12 +1,14 @@
 import os
 import time
 import json
-from openai import OpenAI
 from config import Config
+from clients import get_openai_client
+from resilience_utils import call_with_fallback
+from usage_utils import record_usage
+from storage import get_storage, history_key
+from session_store import record_turn
 import sys
 
-client = OpenAI(api_key=Config.OPENAI_API_KEY)
-
 def get_conversation_pairs(chat_history, max_lines=None):
     """
     Extract the most recent conversation lines from chat history.
@@ -42,7 +44,7 @@ def get_conversation_pairs(chat_history, max_lines=None):
 
 
 def chatcompletion(
-    user_input, user_name, user_prompt, user_token, language, chat_history
+    user_input, user_name, user_prompt, user_token, language, chat_history, chatbot=None
 ):
     """
     Generate chat completion with conversation context.
@@ -86,53 +88,90 @@ def chatcompletion(
     if limited_history:
         system_prompt += f"\n\nPrevious conversation history:\n{limited_history}"
 
-    # --- Responses API call ---
-    output = client.responses.create(
-        model=model_name,
-        max_output_tokens=2000,
-        input=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_input},
-        ],
-    )
+    # Fall back from the advanced model to the base model when it is slow or failing
+    models = [model_name] if model_name == BASE_MODEL else [model_name, BASE_MODEL]
+
+    def create_response(model, timeout):
+        # --- Responses API call ---
+        return get_openai_client().with_options(timeout=timeout, max_retries=0).responses.create(
+            model=model,
+            max_output_tokens=2000,
+            input=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_input},
+            ],
+        )
+
+    def record_completion(output, model, seconds, hedged):
+        # Every completed call is billed, including hedges that lost and late answers after a fallback
+        usage = getattr(output, "usage", None)
+        record_usage(
+            "completion", model, chatbot=chatbot, language=language,
+            input_tokens=getattr(usage, "input_tokens", None),
+            output_tokens=getattr(usage, "output_tokens", None),
+            latency_ms=round(seconds * 1000), hedged=hedged,
+        )
+
+    output, used_model = call_with_fallback(create_response, models, on_complete=record_completion)
+    if used_model != model_name:
+        print(f"Fell back to model: {used_model}")
 
     # Get the text output
     return output.output_text
 
 
 
-def chat(user_input, user_name, user_prompt, user_token, language):
+def chat(user_input, user_name, user_prompt, user_token, language, conversation=None):
     """
     Main chat function that handles conversation flow and history management.
     Uses unified file format: DD/MM HH:MM:SS User: message / DD/MM HH:MM:SS Assistant: response
+    If a conversation record from the session store is given, its cached recent
+    lines are used instead of re-reading the history file, and the new turn is saved to it.
     """
-    history_file = os.path.join(Config.CHAT_HISTORY_DIR, f'chat_history{user_token}.txt')
+    history_file = history_key(user_token)
+    storage = get_storage()
     print(f"Using token: {user_token}")  
     print(f"History file: {history_file}")  
 
-    # Read existing chat history
-    try:
-        with open(history_file, 'r', encoding='utf-8') as f:
-            chat_history = f.read()
-    except FileNotFoundError:
-        chat_history = ""
+    if conversation is not None and conversation.get("recent_lines") is not None:
+        chat_history = "\n".join(conversation["recent_lines"])
+        has_history = conversation["turns"] > 0
+    else:
+        # Read existing chat history
+        data = storage.read(history_file)
+        chat_history = data.decode('utf-8') if data else ""
+        has_history = bool(chat_history)
+
+        if conversation is not None:
+            # Seed the cache from the file once
+            message_lines = [
+                line for line in chat_history.splitlines()
+                if ' User: ' in line or ' Assistant: ' in line
+            ]
+            conversation["recent_lines"] = message_lines[-Config.CUTOFF_LINE_INDEX:]
+            conversation["turns"] = sum(1 for line in message_lines if ' User: ' in line)
 
     # Generate response with context
-    response = chatcompletion(user_input, user_name, user_prompt, user_token, language, chat_history)
+    chatbot = conversation.get("chatbot") if conversation is not None else None
+    response = chatcompletion(user_input, user_name, user_prompt, user_token, language, chat_history, chatbot)
 
     # Save the new conversation to file in unified format
     current_day = time.strftime("%d/%m", time.localtime())
     current_time = time.strftime("%H:%M:%S", time.localtime())
 
+    user_line = f"{current_day} {current_time} User: {user_input}"
+    assistant_line = f"{current_day} {current_time} Assistant: {response}"
+    if conversation is not None:
+        conversation["recent_lines"] = (conversation["recent_lines"] + [user_line, assistant_line])[-Config.CUTOFF_LINE_INDEX:]
+        conversation["turns"] += 1
+        record_turn(user_token, conversation, [user_line, assistant_line])
+
     try:
         # Append new conversation pair to file
-        with open(history_file, "a", encoding="utf-8") as f:
-            if chat_history:
-                f.write(f"\n{current_day} {current_time} User: {user_input}")
-                f.write(f"\n{current_day} {current_time} Assistant: {response}")
-            else:
-                f.write(f"{current_day} {current_time} User: {user_input}")
-                f.write(f"\n{current_day} {current_time} Assistant: {response}")
+        if has_history:
+            storage.append(history_file, f"\n{user_line}\n{assistant_line}".encode("utf-8"))
+        else:
+            storage.append(history_file, f"{user_line}\n{assistant_line}".encode("utf-8"))
 
         print(f"Successfully wrote to {history_file}", file=sys.stderr)
 
@@ -147,8 +186,8 @@ def chat(user_input, user_name, user_prompt, user_token, language):
     return response
 
 
-def get_response(userText, user_name, user_prompt, user_token, language):
+def get_response(userText, user_name, user_prompt, user_token, language, conversation=None):
     """
     Public interface for getting chat responses.
     """
-    return chat(userText, user_name, user_prompt, user_token, language)
+    return chat(userText, user_name, user_prompt, user_token, language, conversation)
@@ -0,0 +1,55 @@
+import os
+import sys
+import ssl
+import time
+import threading
+from config import Config
+
+# Heavy clients are created on first use rather than at import time, so worker
+# processes start quickly and modules can be imported without every secret set.
+_lock = threading.Lock()
+_openai_client = None
+_ssl_context = None
+_directories_ready = False
+
+
+def get_openai_client():
+    """Return the shared OpenAI client, creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                started = time.perf_counter()
+                from openai import OpenAI
+                if not Config.OPENAI_API_KEY:
+                    raise ValueError("Missing or invalid required environment variables: OPENAI_API_KEY")
+                _openai_client = OpenAI(api_key=Config.OPENAI_API_KEY)
+                print(f"OpenAI client initialized in {(time.perf_counter() - started) * 1000:.0f} ms", file=sys.stderr)
+    return _openai_client
+
+
+def get_ssl_context():
+    """Return the server SSL context, loading the certificate chain on first use.
+    Only needed when serving HTTPS directly; under mod_wsgi Apache handles TLS."""
+    global _ssl_context
+    if _ssl_context is None:
+        with _lock:
+            if _ssl_context is None:
+                missing = [name for name in ('CERT_FILE', 'KEY_FILE') if not getattr(Config, name)]
+                if missing:
+                    raise ValueError(f"Missing or invalid required environment variables: {', '.join(missing)}")
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                context.load_cert_chain(Config.CERT_FILE, Config.KEY_FILE, password=Config.SSL_KEY_PASSWORD)
+                _ssl_context = context
+    return _ssl_context
+
+
+def ensure_directories():
+    """Create the directories the app writes to. Cheap to call repeatedly.
+    Nothing to create when files are kept in shared storage (STORAGE_BACKEND sqlite or s3)."""
+    global _directories_ready
+    if not _directories_ready:
+        if Config.STORAGE_BACKEND == "local":
+            for directory in [Config.AUDIO_DIR, Config.CHAT_HISTORY_DIR]:
+                os.makedirs(directory, exist_ok=True)
+        _directories_ready = True
@@ -22,6 +22,8 @@ class Config:
     KEY_FILE = os.environ.get('KEY_FILE')
     SSL_KEY_PASSWORD = os.environ.get('SSL_KEY_PASSWORD', '')
     CHAT_HISTORY_DIR = os.path.join(BASE_DIR, 'conversation_history')
+    AUDIO_DIR = os.path.join(BASE_DIR, 'audio_files')
+    PROMPT_FILE = os.path.join(BASE_DIR, 'AIPrompt.json')
 
     # SMTP Configuration
     SMTP_SERVER = os.environ.get('SMTP_SERVER')
@@ -32,6 +34,49 @@ class Config:
     # Cutoff line index for chat history
     CUTOFF_LINE_INDEX = int(os.getenv('CUTOFF_LINE_INDEX', 30))
 
+    # Upstream resilience for chat completions
+    COMPLETION_TIMEOUT = float(os.getenv('COMPLETION_TIMEOUT', 30))
+    HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', 'False').lower() in ('true', '1', 't')
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 1.0))
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+    BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', 30))
+    UPSTREAM_MAX_WORKERS = int(os.getenv('UPSTREAM_MAX_WORKERS', 16))
+
+    # Server-side conversation store: sqlite or redis (shared by worker processes), or memory (single process only)
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite').lower()
+    SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', os.path.join(BASE_DIR, 'sessions.db'))
+    SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+    SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', 6 * 60 * 60))
+
+    # Local speech engine (used for languages routed to "local" in TRANSCRIPTION_BACKENDS / TTS_BACKENDS)
+    LOCAL_WHISPER_MODEL = os.getenv('LOCAL_WHISPER_MODEL', 'base')
+    LOCAL_SPEECH_WORKERS = int(os.getenv('LOCAL_SPEECH_WORKERS', 2))
+    # Seconds a request waits for a local transcription or synthesis before giving up
+    LOCAL_SPEECH_TIMEOUT = float(os.getenv('LOCAL_SPEECH_TIMEOUT', 300))
+
+    # Trim silence and re-encode recordings before transcription (needs numpy; ffmpeg for browser formats)
+    PREPROCESS_AUDIO = os.getenv('PREPROCESS_AUDIO', 'True').lower() in ('true', '1', 't')
+
+    # Full-text search index over submitted conversations
+    SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', os.path.join(BASE_DIR, 'search_index.db'))
+
+    # Append-only log of every upstream call (tokens, characters, audio seconds, latency)
+    USAGE_LOG_FILE = os.getenv('USAGE_LOG_FILE', os.path.join(BASE_DIR, 'usage_log.jsonl'))
+
+    # Idempotency-Key result store for /get_response, /whisper and /send_transcript: memory or sqlite
+    IDEMPOTENCY_BACKEND = os.getenv('IDEMPOTENCY_BACKEND', 'sqlite').lower()
+    IDEMPOTENCY_DB_PATH = os.getenv('IDEMPOTENCY_DB_PATH', os.path.join(BASE_DIR, 'idempotency.db'))
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 10 * 60))
+
+    # Where history, audio, submissions and (for shared backends) prompts are stored: local, sqlite or s3.
+    # Use sqlite or s3 to run several app servers behind a load balancer.
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local').lower()
+    STORAGE_SQLITE_PATH = os.getenv('STORAGE_SQLITE_PATH', os.path.join(BASE_DIR, 'storage.db'))
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+    PROMPT_REFRESH_SECONDS = float(os.getenv('PROMPT_REFRESH_SECONDS', 2))
+
     # Flask Debug mode
     DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
     CWD = os.getcwd()
@@ -43,8 +88,6 @@ class Config:
         required_configs = [
             ('OPENAI_API_KEY', cls.OPENAI_API_KEY),
             ('SECRET_KEY', cls.SECRET_KEY),
-            ('CERT_FILE', cls.CERT_FILE),
-            ('KEY_FILE', cls.KEY_FILE),
             ('SMTP_SERVER', cls.SMTP_SERVER),
             ('SMTP_PORT', cls.SMTP_PORT),
             ('SMTP_USERNAME', cls.SMTP_USERNAME),
@@ -6,14 +6,15 @@ from email.mime.base import MIMEBase
 from email import encoders
 from config import Config
 from flask import jsonify
+from storage import get_storage, history_key
 
 def send_transcript(user_token, professor_email, student_email, professor_name, extra_note, student_name, chatbot_name, current_datetime):
-    history_file = os.path.join(Config.CHAT_HISTORY_DIR, f'chat_history{user_token}.txt')
-    if not os.path.exists(history_file):
+    history_file = history_key(user_token)
+    history_data = get_storage().read(history_file)
+    if history_data is None:
         return jsonify({"error": "Chat history not found!"}), 404
 
-    with open(history_file, 'r', encoding='utf-8') as f:
-        transcript = f.read()
+    transcript = history_data.decode('utf-8')
 
     default_message = (
         f"Hi {{name}},\n\n"
@@ -33,12 +34,11 @@ def send_transcript(user_token, professor_email, student_email, professor_name,
 
     try:
         # Create attachment once
-        with open(history_file, 'rb') as attachment:
-            file_part = MIMEBase('application', 'octet-stream')
-            file_part.set_payload(attachment.read())
-            encoders.encode_base64(file_part)
-            attachment_filename = os.path.basename(history_file)
-            file_part.add_header("Content-Disposition", f"attachment; filename={attachment_filename}")
+        file_part = MIMEBase('application', 'octet-stream')
+        file_part.set_payload(history_data)
+        encoders.encode_base64(file_part)
+        attachment_filename = os.path.basename(history_file)
+        file_part.add_header("Content-Disposition", f"attachment; filename={attachment_filename}")
 
         def send_email(to_email, body, recipient_name=""):
             msg = MIMEMultipart()
@@ -0,0 +1,207 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from functools import wraps
+from flask import request, make_response, jsonify, g
+from config import Config
+
+# How long a request may stay in flight before a waiting retry gives up on it
+PENDING_TIMEOUT = 180
+
+
+class MemoryIdempotencyBackend:
+    """Per-process result store. Retries must reach the same worker process."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._cond = threading.Condition()
+
+    def _prune(self, now):
+        expired = [key for key, entry in self._entries.items() if entry["expires"] < now]
+        for key in expired:
+            del self._entries[key]
+
+    def begin(self, key, fingerprint):
+        """
+        Claim a key. Returns ("new", None) if the caller should run the request,
+        ("done", entry) with the stored result, or ("mismatch", None) if the key
+        was used with a different request body. Waits while the key is in flight.
+        """
+        deadline = time.monotonic() + PENDING_TIMEOUT
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._entries[key] = {"state": "pending", "fingerprint": fingerprint, "expires": now + PENDING_TIMEOUT}
+                    return "new", None
+                if entry["fingerprint"] != fingerprint:
+                    return "mismatch", None
+                if entry["state"] == "done":
+                    return "done", entry
+                remaining = deadline - now
+                if remaining <= 0:
+                    return "timeout", None
+                self._cond.wait(remaining)
+
+    def complete(self, key, status, body, content_type):
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.update(state="done", status=status, body=body, content_type=content_type,
+                             expires=time.monotonic() + self.ttl)
+            self._cond.notify_all()
+
+    def release(self, key):
+        """Forget a key whose request failed so a retry runs it again."""
+        with self._cond:
+            self._entries.pop(key, None)
+            self._cond.notify_all()
+
+
+class SQLiteIdempotencyBackend:
+    """Result store shared by all worker processes on one host."""
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            "key TEXT PRIMARY KEY, fingerprint TEXT, state TEXT, status INTEGER, "
+            "body BLOB, content_type TEXT, expires REAL)"
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, key, fingerprint):
+        conn = self._conn()
+        deadline = time.monotonic() + PENDING_TIMEOUT
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM idempotency WHERE expires < ?", (now,))
+                row = conn.execute(
+                    "SELECT fingerprint, state, status, body, content_type FROM idempotency WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO idempotency (key, fingerprint, state, expires) VALUES (?, ?, 'pending', ?)",
+                        (key, fingerprint, now + PENDING_TIMEOUT),
+                    )
+            finally:
+                conn.execute("COMMIT")
+
+            if row is None:
+                return "new", None
+            if row[0] != fingerprint:
+                return "mismatch", None
+            if row[1] == "done":
+                return "done", {"status": row[2], "body": row[3], "content_type": row[4]}
+            if time.monotonic() >= deadline:
+                return "timeout", None
+            time.sleep(self.POLL_INTERVAL)
+
+    def complete(self, key, status, body, content_type):
+        self._conn().execute(
+            "UPDATE idempotency SET state = 'done', status = ?, body = ?, content_type = ?, expires = ? WHERE key = ?",
+            (status, body, content_type, time.time() + self.ttl, key),
+        )
+
+    def release(self, key):
+        self._conn().execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_idempotency_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if Config.IDEMPOTENCY_BACKEND == "sqlite":
+                    _backend = SQLiteIdempotencyBackend(Config.IDEMPOTENCY_DB_PATH, Config.IDEMPOTENCY_TTL_SECONDS)
+                elif Config.IDEMPOTENCY_BACKEND == "memory":
+                    _backend = MemoryIdempotencyBackend(Config.IDEMPOTENCY_TTL_SECONDS)
+                else:
+                    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {Config.IDEMPOTENCY_BACKEND}")
+    return _backend
+
+
+def _request_fingerprint():
+    """Hash of the JSON body, so a key reused for a different request is rejected.
+    Multipart uploads are not fingerprinted: browsers pick a new boundary on every send."""
+    if request.is_json:
+        return hashlib.sha256(request.get_data(cache=True)).hexdigest()
+    return ""
+
+
+def mark_state_written():
+    """
+    Call from an idempotent route once it has saved something that must not be
+    saved twice. From then on the response is stored even if it is a server error,
+    so a retry replays it instead of running the route again.
+    """
+    g.idempotency_state_written = True
+
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header on a route. The first request with a key runs
+    normally and its response is stored for IDEMPOTENCY_TTL_SECONDS; repeats get the
+    stored response, and repeats that arrive while it is still running wait for it.
+    Server errors (5xx) are not stored, so a retry after one runs the request again,
+    unless the route called mark_state_written() first.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key is too long'}), 400
+
+        backend = get_idempotency_backend()
+        scoped_key = f"{request.path}:{key}"
+        state, entry = backend.begin(scoped_key, _request_fingerprint())
+        if state == "mismatch":
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if state == "timeout":
+            return jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409
+        if state == "done":
+            response = make_response(entry["body"], entry["status"])
+            response.headers["Content-Type"] = entry["content_type"]
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            if g.get("idempotency_state_written"):
+                backend.complete(scoped_key, 500, b'{"error": "Internal server error"}', "application/json")
+            else:
+                backend.release(scoped_key)
+            raise
+        if response.status_code >= 500 and not g.get("idempotency_state_written"):
+            backend.release(scoped_key)
+        else:
+            backend.complete(scoped_key, response.status_code, response.get_data(), response.content_type)
+        return response
+
+    return wrapper
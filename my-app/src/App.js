@@ -44,6 +44,32 @@ import { Routes, Route, useNavigate, useLocation } from "react-router-dom";
 import ProfessorView from "./pages/ProfessorView";
 import React, { useEffect, useRef, useState, useCallback, useImperativeHandle, useMemo} from "react";
 
+// =============================================
+// IDEMPOTENT POST
+// Sends one Idempotency-Key for all attempts of a request, so when a flaky
+// connection drops the response and we retry, the server replays the original
+// result instead of paying for (and storing) the work twice.
+// =============================================
+const newIdempotencyKey = () =>
+    (window.crypto && window.crypto.randomUUID)
+        ? window.crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+const postIdempotent = async (url, data, config = {}, retries = 2) => {
+    const headers = { ...(config.headers || {}), 'Idempotency-Key': newIdempotencyKey() };
+    for (let attempt = 0; ; attempt++) {
+        try {
+            return await axios.post(url, data, { ...config, headers });
+        } catch (error) {
+            // Only retry when the response never arrived or the gateway failed
+            const status = error.response?.status;
+            const retriable = !error.response || status === 502 || status === 504;
+            if (!retriable || attempt >= retries) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)));
+        }
+    }
+};
+
 // =============================================
 // GLOBAL CONSTANTS / MOCK DATA
 // =============================================
@@ -757,6 +783,7 @@ const ChatMessages = React.memo(React.forwardRef(({ messages, playAudio, generat
 
 const PromptEditor = () => {
     const [allPrompts, setAllPrompts] = useState({});
+    const [promptRevision, setPromptRevision] = useState(null); // Revision the editor's data is based on
     const [availableLanguages, setAvailableLanguages] = useState([]);
     const [selectedLanguage, setSelectedLanguage] = useState('');
     const [selectedPromptTitle, setSelectedPromptTitle] = useState('');
@@ -789,6 +816,7 @@ const PromptEditor = () => {
             const response = await axios.get(`/api/data`);
             setAllPrompts(response.data);
             setAvailableLanguages(getUniqueLanguages(response.data));
+            setPromptRevision(response.headers['x-prompt-revision'] ?? null);
         } catch (error) {
             console.error("Failed to fetch prompts:", error);
             setStatusMessage("Error: Could not load existing prompts.");
@@ -826,9 +854,11 @@ const PromptEditor = () => {
         try {
             const response = await axios.post('/api/delete_prompt', {
                 prompt_name: promptToDelete,
+                revision: promptRevision, // Rejected with 409 if someone else changed the prompts meanwhile
             });
 
             if (response.data.success) {
+                setPromptRevision(response.data.revision); // Our own change must not count as a conflict
                 setStatusMessage(`Prompt "${promptToDelete}" deleted successfully!`); // Use setStatusMessage for feedback
                 // Update PromptEditor's state to reflect deletion
                 if (selectedPromptTitle === promptToDelete) { // Use selectedPromptTitle here
@@ -850,7 +880,7 @@ const PromptEditor = () => {
             }
         } catch (error) {
             console.error('Error deleting prompt:', error);
-            setStatusMessage('Failed to delete prompt. Please check console for details.');
+            setStatusMessage(error.response?.data?.message || 'Failed to delete prompt. Please check console for details.');
         } finally {
             setPromptToDelete(null); // Clear the prompt to delete
         }
@@ -919,7 +949,8 @@ const PromptEditor = () => {
             : `/api/save_prompt`;  // URL for creating
 
         try {
-            const response = await axios.post(url, formData);
+            const response = await axios.post(url, { ...formData, revision: promptRevision });
+            setPromptRevision(response.data.revision); // Our own change must not count as a conflict
             setStatusMessage(`Success: ${response.data.message}`);
 
             // Refresh the list of prompts after saving to ensure UI is up-to-date
@@ -1298,7 +1329,7 @@ function App(props) {
             //const response = await axios.post(`https://${flaskHOST}:${flaskPORT}/tts`, {
             const response = await axios.post(`/api/tts`, {
                 text: text,
-                voice: 'alloy'
+                language: language
             });
 
             if (response.data && response.data.audio_filename) {
@@ -1312,7 +1343,7 @@ function App(props) {
             console.error('Error generating TTS:', error);
             return null;
         }
-    }, []);
+    }, [language]);
 
     //Config Change Starts Here
     // =============================================
@@ -1572,7 +1603,7 @@ function App(props) {
         setLanguage(languageToUse);
 
         try {
-            const response = await axios.post(`/api/get_response`, {
+            const response = await postIdempotent(`/api/get_response`, {
                 message: message || 'Audio message',
                 selectedChatbot: selectedChatbot,
                 user_token: currentToken,
@@ -1670,7 +1701,7 @@ function App(props) {
         });
 
         try {
-            const response = await axios.post(`/api/whisper`, formData, {
+            const response = await postIdempotent(`/api/whisper`, formData, {
                 headers: {
                     'Content-Type': 'multipart/form-data'
                 },
@@ -1748,7 +1779,7 @@ function App(props) {
 
         setEmailStatus('Sending transcript...');
         try {
-            const response = await axios.post(`/api/send_transcript`, {
+            const response = await postIdempotent(`/api/send_transcript`, {
                 user_token: userToken,
                 professor_email: professorEmail,
                 professor_name: professorName,
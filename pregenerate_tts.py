@@ -0,0 +1,85 @@
+# pregenerate_tts.py
+"""
+Generate TTS audio ahead of class for every chatbot greeting.
+
+Prompts come from the prompt store the app uses (AIPrompt.json, or shared
+storage when STORAGE_BACKEND is sqlite or s3) unless --prompt-file is given.
+
+Covers each entry's initialText. Audio goes into the same cache the /tts
+route uses, so the first play of a greeting is served straight from disk.
+
+The job is resumable: anything already in the cache is skipped, so an
+interrupted run can simply be started again. Run it off-peak, e.g. from cron:
+
+    python pregenerate_tts.py --workers 4
+"""
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tts_utils import generate_tts_audio, tts_cache_filename, voice_for_language
+from storage import get_storage, audio_key
+from prompt_store import get_prompt_store
+
+
+def collect_jobs(prompts, languages=None):
+    """Build a de-duplicated list of (title, text, voice, language) to synthesize."""
+    jobs = []
+    seen = set()
+    for title, entry in prompts.items():
+        language = entry.get("language")
+        if languages and language not in languages:
+            continue
+        voice = voice_for_language(language)
+
+        text = entry.get("initialText")
+        if not text or not text.strip():
+            continue
+        key = (text, voice, language)
+        if key in seen:
+            continue
+        seen.add(key)
+        jobs.append((title, text, voice, language))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate TTS audio for all chatbots.")
+    parser.add_argument("--prompt-file", help="Read prompts from this JSON file instead of the prompt store")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum concurrent TTS requests")
+    parser.add_argument("--language", action="append", help="Only generate for this language (repeatable)")
+    args = parser.parse_args()
+
+    if args.prompt_file:
+        with open(args.prompt_file, "r", encoding="utf-8") as f:
+            prompts = json.load(f)
+    else:
+        prompts = get_prompt_store().load()[0]
+
+    storage = get_storage()
+    jobs = collect_jobs(prompts, args.language)
+    pending = [job for job in jobs if not storage.exists(audio_key(tts_cache_filename(job[1], job[2], job[3])))]
+    print(f"{len(jobs)} audio clips, {len(jobs) - len(pending)} already cached, {len(pending)} to generate")
+
+    started = time.time()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {
+            executor.submit(generate_tts_audio, text, voice, language): (title, text)
+            for title, text, voice, language in pending
+        }
+        for future in as_completed(futures):
+            title, text = futures[future]
+            if future.result():
+                print(f"OK   {title}: {text[:40]}")
+            else:
+                failed += 1
+                print(f"FAIL {title}: {text[:40]}")
+
+    print(f"Done in {time.time() - started:.1f}s, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import mmap
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from config import Config
+from storage import get_storage, StorageConflictError
+
+# Number of entries kept in the shared store's change feed
+MAX_SHARED_CHANGES = 500
+
+
+class PromptConflictError(Exception):
+    """Raised when an update was based on an older revision of AIPrompt.json."""
+
+    def __init__(self, current_revision):
+        super().__init__(f"Prompts were changed by someone else (current revision {current_revision})")
+        self.current_revision = current_revision
+
+
+class PromptNotFoundError(KeyError):
+    pass
+
+
+class PromptExistsError(KeyError):
+    pass
+
+
+class _PromptEdits:
+    """create/update/delete on top of a store's _modify(action, title, expected_revision, apply)."""
+
+    def create(self, title, entry, expected_revision=None):
+        def apply(prompts):
+            if title in prompts:
+                raise PromptExistsError(title)
+            prompts[title] = entry
+        return self._modify("create", title, expected_revision, apply)
+
+    def update(self, title, entry, expected_revision=None):
+        def apply(prompts):
+            if title not in prompts:
+                raise PromptNotFoundError(title)
+            prompts[title] = entry
+        return self._modify("update", title, expected_revision, apply)
+
+    def delete(self, title, expected_revision=None):
+        def apply(prompts):
+            if title not in prompts:
+                raise PromptNotFoundError(title)
+            del prompts[title]
+        return self._modify("delete", title, expected_revision, apply)
+
+
+class PromptStore(_PromptEdits):
+    """
+    Versioned storage for AIPrompt.json shared by all worker processes.
+
+    Writers take an exclusive file lock, check the caller's expected revision
+    (compare-and-swap), write a temporary file and atomically rename it over
+    AIPrompt.json, so readers never see a half-written file.
+
+    The revision number lives in a small memory-mapped file. Every process maps
+    it, so checking whether its cached prompts are stale is a memory read rather
+    than a stat or read of AIPrompt.json. Each change is also appended to a
+    change feed that can be read with changes_since().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock_path = path + ".lock"
+        self._revision_path = path + ".rev"
+        self._changes_path = path + ".changes"
+        self._cache = None
+        self._cache_revision = None
+        self._cache_lock = threading.Lock()
+
+        with self._locked():
+            if not os.path.exists(self._revision_path) or os.path.getsize(self._revision_path) < 8:
+                with open(self._revision_path, "wb") as f:
+                    f.write((0).to_bytes(8, "little"))
+        with open(self._revision_path, "r+b") as f:
+            self._revision_map = mmap.mmap(f.fileno(), 8)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def revision(self):
+        """Current revision, read from shared memory."""
+        return int.from_bytes(self._revision_map[:8], "little")
+
+    def _read_file(self):
+        """Parsed AIPrompt.json, or None if it is missing or not valid JSON (e.g. caught mid-edit)."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def load(self):
+        """
+        Return (prompts, revision). The parsed prompts are cached per process and
+        only re-read after another process (or thread) bumps the revision.
+        Callers must treat the returned dictionary as read-only.
+        """
+        revision = self.revision()
+        with self._cache_lock:
+            if self._cache is None or self._cache_revision != revision:
+                # The file is replaced before the revision is bumped, so content
+                # read now is at least as new as `revision`
+                prompts = self._read_file()
+                if prompts is None:
+                    # Not cached, so the next call tries again; keep serving the last good prompts meanwhile
+                    print(f"Could not read {self.path}; retrying on the next request")
+                    return (self._cache, self._cache_revision) if self._cache is not None else ({}, revision)
+                self._cache = prompts
+                self._cache_revision = revision
+            return self._cache, self._cache_revision
+
+    def _write(self, prompts):
+        """Atomically replace AIPrompt.json; must be called while holding the file lock."""
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=".AIPrompt.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(prompts, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.path):
+                os.chmod(tmp_path, os.stat(self.path).st_mode & 0o777)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _bump(self, current_revision, action, title):
+        """Publish a new revision and record it in the change feed; must hold the file lock."""
+        new_revision = current_revision + 1
+        self._revision_map[:8] = new_revision.to_bytes(8, "little")
+        self._revision_map.flush()
+
+        change = {"revision": new_revision, "action": action, "title": title, "time": int(time.time())}
+        with open(self._changes_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(change, ensure_ascii=False) + "\n")
+        return new_revision
+
+    def _modify(self, action, title, expected_revision, apply):
+        with self._locked():
+            current = self.revision()
+            if expected_revision is not None and int(expected_revision) != current:
+                raise PromptConflictError(current)
+            prompts = self._read_file()
+            if prompts is None:
+                if os.path.exists(self.path):
+                    # Don't replace a hand-edited file that has a syntax error with an almost empty one
+                    raise ValueError(f"{self.path} is not valid JSON")
+                prompts = {}
+            apply(prompts)
+            self._write(prompts)
+            return self._bump(current, action, title)
+
+    def reload(self):
+        """Bump the revision after AIPrompt.json was edited by hand, so every process re-reads it."""
+        with self._locked():
+            return self._bump(self.revision(), "reload", None)
+
+    def changes_since(self, revision):
+        """Changes with a revision greater than `revision`, oldest first."""
+        changes = []
+        try:
+            with open(self._changes_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        continue
+                    if change["revision"] > revision:
+                        changes.append(change)
+        except FileNotFoundError:
+            pass
+        return changes
+
+
+class SharedPromptStore(_PromptEdits):
+    """
+    Prompts kept in shared storage (STORAGE_BACKEND sqlite or s3) so every server
+    sees the same ones. Prompts, revision and change feed live in one object that
+    is updated with a conditional write, so concurrent edits from different
+    servers cannot overwrite each other. The first server to start seeds it from
+    the local AIPrompt.json.
+
+    Each process re-reads the object at most every PROMPT_REFRESH_SECONDS.
+    """
+
+    KEY = "prompt_store.json"
+
+    def __init__(self, storage, seed_path, refresh_seconds):
+        self.storage = storage
+        self.seed_path = seed_path
+        self.refresh_seconds = refresh_seconds
+        self._cache = None
+        self._cache_time = 0
+        self._cache_lock = threading.Lock()
+
+    def _read_local_file(self):
+        try:
+            with open(self.seed_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _read(self):
+        """Return (document, version), seeding the shared object if it does not exist yet."""
+        while True:
+            data, version = self.storage.read_versioned(self.KEY)
+            if data is not None:
+                return json.loads(data), version
+            document = {"revision": 0, "prompts": self._read_local_file(), "changes": []}
+            try:
+                self.storage.write_if(self.KEY, self._encode(document), None)
+            except StorageConflictError:
+                continue  # Another server seeded it first
+            print(f"Seeded shared prompt store from {self.seed_path}")
+
+    @staticmethod
+    def _encode(document):
+        return json.dumps(document, ensure_ascii=False).encode("utf-8")
+
+    def load(self):
+        """Return (prompts, revision). Callers must treat the returned dictionary as read-only."""
+        with self._cache_lock:
+            if self._cache is None or time.monotonic() - self._cache_time >= self.refresh_seconds:
+                self._cache = self._read()[0]
+                self._cache_time = time.monotonic()
+            return self._cache["prompts"], self._cache["revision"]
+
+    def revision(self):
+        return self.load()[1]
+
+    def _modify(self, action, title, expected_revision, apply, retries=10):
+        for _ in range(retries):
+            document, version = self._read()
+            current = document["revision"]
+            if expected_revision is not None and int(expected_revision) != current:
+                raise PromptConflictError(current)
+            apply(document["prompts"])
+            document["revision"] = current + 1
+            document["changes"] = (document["changes"] + [
+                {"revision": current + 1, "action": action, "title": title, "time": int(time.time())}
+            ])[-MAX_SHARED_CHANGES:]
+            try:
+                self.storage.write_if(self.KEY, self._encode(document), version)
+            except StorageConflictError:
+                continue  # Someone else wrote in between; re-check against their revision
+            with self._cache_lock:
+                self._cache = document
+                self._cache_time = time.monotonic()
+            return document["revision"]
+        raise PromptConflictError(self._read()[0]["revision"])
+
+    def reload(self):
+        """Replace the shared prompts with the local AIPrompt.json after it was edited by hand."""
+        prompts = self._read_local_file()
+
+        def apply(current):
+            current.clear()
+            current.update(prompts)
+        return self._modify("reload", None, None, apply)
+
+    def changes_since(self, revision):
+        """Changes with a revision greater than `revision`, oldest first (only the most recent are kept)."""
+        return [change for change in self._read()[0]["changes"] if change["revision"] > revision]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_prompt_store():
+    """Return the prompt store for the configured STORAGE_BACKEND, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if Config.STORAGE_BACKEND == "local":
+                    _store = PromptStore(Config.PROMPT_FILE)
+                else:
+                    _store = SharedPromptStore(get_storage(), Config.PROMPT_FILE, Config.PROMPT_REFRESH_SECONDS)
+    return _store
+
+
+if __name__ == "__main__":
+    # python prompt_store.py -> tell running workers that AIPrompt.json was edited by hand
+    # (with a shared STORAGE_BACKEND, this uploads the local AIPrompt.json for every server)
+    print(f"Prompt revision is now {get_prompt_store().reload()}")
@@ -0,0 +1,258 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from config import Config
+
+# Shared pool for upstream calls. Threads cannot be cancelled, so every call
+# made through here must also carry its own request timeout.
+_executor = ThreadPoolExecutor(max_workers=Config.UPSTREAM_MAX_WORKERS, thread_name_prefix="upstream")
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when every model in the fallback chain failed or was skipped."""
+
+
+class UpstreamBusyError(Exception):
+    """Raised when an attempt could not start because every upstream worker thread was busy."""
+
+
+def is_upstream_failure(error):
+    """
+    True for errors that say something about the model's health: timeouts,
+    connection errors, rate limits (429) and server errors (5xx). Other client
+    errors (bad request, context too long, ...) are caused by the request itself.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, ValueError):
+        # Configuration errors, e.g. get_openai_client() without OPENAI_API_KEY
+        return False
+    try:
+        import openai
+    except ImportError:
+        openai = None
+    if openai is not None and isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Unknown errors count against the model, as before
+    return True
+
+
+class LatencyTracker:
+    """Keeps a rolling window of successful call latencies for one model."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self):
+        """Return the 95th percentile latency, or None until enough samples exist."""
+        with self._lock:
+            if len(self._samples) < 20:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class CircuitBreaker:
+    """
+    Stops traffic to a model after repeated failures.
+    closed -> open after `failure_threshold` consecutive failures,
+    open -> half-open after `reset_timeout` seconds (one trial call allowed),
+    half-open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half-open: let a single trial request through
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """End a half-open trial without a verdict, so the next call can try again."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return "open"
+            return "half-open"
+
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(model_name):
+    with _registry_lock:
+        if model_name not in _breakers:
+            _breakers[model_name] = CircuitBreaker(
+                Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RESET_SECONDS
+            )
+        return _breakers[model_name]
+
+
+def get_latency_tracker(model_name):
+    with _registry_lock:
+        if model_name not in _latencies:
+            _latencies[model_name] = LatencyTracker()
+        return _latencies[model_name]
+
+
+class _Call:
+    """One submitted request; `started` is set once a worker thread picks it up."""
+
+    def __init__(self, hedged=False):
+        self.started = None
+        self.hedged = hedged
+
+
+def _timed_call(fn, model_name, timeout, call, on_complete):
+    started = call.started = time.monotonic()
+    result = fn(model_name, timeout)
+    elapsed = time.monotonic() - started
+    get_latency_tracker(model_name).record(elapsed)
+    if on_complete is not None:
+        # Runs for every call that returns, including hedges that lost and calls
+        # that finished after their attempt was abandoned: all of them are billed
+        try:
+            on_complete(result, model_name, elapsed, call.hedged)
+        except Exception as e:
+            print(f"Error in on_complete for {model_name}: {e}")
+    return result
+
+
+def _hedge_delay(model_name):
+    """Delay before firing a duplicate request: the model's p95, floored by config."""
+    p95 = get_latency_tracker(model_name).p95()
+    if p95 is None:
+        return None
+    return max(p95, Config.HEDGE_MIN_DELAY)
+
+
+def _attempt(fn, model_name, timeout, hedge, on_complete=None):
+    """
+    Run one attempt against a model with a hard deadline.
+    If hedging is on, a duplicate request is started once the p95 delay passes
+    and whichever finishes first wins.
+
+    The deadline runs from when a worker thread starts the call, so time spent
+    queued behind other calls is not blamed on the model. If the call cannot
+    even start within `timeout`, UpstreamBusyError is raised instead.
+    """
+    queued_at = time.monotonic()
+    first_call = _Call()
+    futures = {_executor.submit(_timed_call, fn, model_name, timeout, first_call, on_complete)}
+    delay = _hedge_delay(model_name) if hedge else None
+    last_error = None
+
+    while futures:
+        if first_call.started is None:
+            deadline = queued_at + timeout
+        else:
+            deadline = first_call.started + timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        wait_for = min(remaining, delay) if delay is not None else remaining
+        done, futures = wait(futures, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                last_error = e
+
+        if not done and delay is not None and first_call.started is not None:
+            print(f"Hedging request to {model_name} after {delay:.2f}s")
+            futures.add(_executor.submit(_timed_call, fn, model_name, timeout, _Call(hedged=True), on_complete))
+            delay = None
+
+    if last_error is not None:
+        raise last_error
+    if first_call.started is None:
+        for future in futures:
+            future.cancel()
+        raise UpstreamBusyError(f"No upstream worker free for {model_name} within {timeout}s")
+    raise TimeoutError(f"{model_name} did not respond within {timeout}s")
+
+
+def call_with_fallback(fn, models, timeout=None, hedge=None, on_complete=None):
+    """
+    Call `fn(model_name, timeout)` for each model in order until one succeeds.
+    `on_complete(result, model_name, seconds, hedged)` is called for every upstream
+    call that returns, not only the one whose result is used.
+    Models whose circuit breaker is open are skipped.
+    Errors caused by the request itself (see is_upstream_failure) are raised
+    immediately, without falling back or counting against the model.
+    Returns (result, model_name) for the model that answered.
+    """
+    if timeout is None:
+        timeout = Config.COMPLETION_TIMEOUT
+    if hedge is None:
+        hedge = Config.HEDGE_REQUESTS
+
+    errors = []
+    for model_name in models:
+        breaker = get_breaker(model_name)
+        if not breaker.allow():
+            print(f"Circuit open for {model_name}, skipping")
+            errors.append(f"{model_name}: circuit open")
+            continue
+        try:
+            result = _attempt(fn, model_name, timeout, hedge, on_complete)
+            breaker.record_success()
+            return result, model_name
+        except UpstreamBusyError as e:
+            # Says nothing about the model's health, so the breaker is left alone
+            breaker.release_trial()
+            print(f"Upstream call to {model_name} not started: {e}")
+            errors.append(f"{model_name}: {e}")
+        except Exception as e:
+            if not is_upstream_failure(e):
+                breaker.release_trial()
+                raise
+            breaker.record_failure()
+            print(f"Upstream call to {model_name} failed: {e}")
+            errors.append(f"{model_name}: {e}")
+
+    raise UpstreamUnavailableError("All models failed: " + "; ".join(errors))
@@ -0,0 +1,177 @@
+import re
+import html
+import sqlite3
+import threading
+from config import Config
+
+# CJK ideographs, kana and hangul. These scripts have no spaces between words,
+# so each character is indexed as its own token (zero-width spaces are token
+# separators for the unicode61 tokenizer) and a query becomes a phrase of
+# consecutive characters. This matches words of any length, including the
+# two-character vocabulary common in the Japanese and Chinese prompts.
+_CJK_CHAR = re.compile(
+    "(["
+    "\u3040-\u30ff"  # Hiragana, Katakana
+    "\u3400-\u4dbf"  # CJK Extension A
+    "\u4e00-\u9fff"  # CJK Unified Ideographs
+    "\uac00-\ud7af"  # Hangul syllables
+    "\uf900-\ufaff"  # CJK Compatibility Ideographs
+    "\uff66-\uff9f"  # Halfwidth Katakana
+    "])"
+)
+_SEPARATOR = "\u200b"
+
+SNIPPET_START = "\u0002"
+SNIPPET_END = "\u0003"
+
+
+def _segment(text):
+    """Surround CJK characters with zero-width spaces so the tokenizer splits them individually."""
+    return _CJK_CHAR.sub(_SEPARATOR + r"\1" + _SEPARATOR, text or "")
+
+
+def _unsegment(text):
+    """Undo _segment for display."""
+    return text.replace(_SEPARATOR, "")
+
+
+def _match_expression(terms):
+    """Build an FTS5 MATCH expression that ORs quoted phrases, one per term."""
+    phrases = []
+    for term in terms:
+        term = _segment(term.strip())
+        if term:
+            phrases.append('"' + term.replace('"', '""') + '"')
+    return " OR ".join(phrases)
+
+
+def vocabulary_terms(prompt):
+    """Extract the words listed after 'Vocabulary to Integrate:' in a chatbot prompt."""
+    # The list is the rest of that line (or the next line if the heading stands alone)
+    match = re.search(r"Vocabulary to Integrate:\s*([^\n]*)", prompt or "", re.IGNORECASE)
+    if not match:
+        return []
+    # Drop an instruction in front of the list, e.g. "Incorporate these words ...: word, word"
+    words = re.split(r"[:\uff1a]", match.group(1))[-1]
+    # Lists are separated by commas (including CJK and Arabic commas), semicolons or any whitespace
+    words = re.split(r"[,;\s\u060c\u061b\u3001\uff0c]+", words)
+    words = (word.strip(".\u3002\u06d4") for word in words)  # Sentence-final full stops
+    return [word for word in words if word]
+
+
+class SearchIndex:
+    """
+    Incremental SQLite FTS5 index over submitted conversations.
+    One row per message, tagged with the professor, student and chatbot it belongs to.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+            "content, professor UNINDEXED, student_key UNINDEXED, student_name UNINDEXED, "
+            "chatbot_name UNINDEXED, timestamp UNINDEXED, user_token UNINDEXED, role UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS indexed_submissions (professor TEXT, user_token TEXT, timestamp TEXT, "
+                     "PRIMARY KEY (professor, user_token, timestamp))")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def add_submission(self, professor, student_key, record):
+        """Index one submission record as stored in submissions.json. Re-adding is a no-op."""
+        conn = self._conn()
+        professor = professor.lower()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO indexed_submissions VALUES (?, ?, ?)",
+                (professor, record.get("user_token"), record.get("timestamp")),
+            )
+            if cursor.rowcount == 0:
+                return
+            rows = []
+            for turn in record.get("conversation", []):
+                for role in ("user", "assistant"):
+                    if turn.get(role):
+                        rows.append((
+                            _segment(turn[role]), professor, student_key, record.get("name"),
+                            record.get("chatbot_name"), record.get("timestamp"), record.get("user_token"), role,
+                        ))
+            conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def add_all(self, submissions):
+        """Index every submission in a submissions.json structure (used to backfill)."""
+        for professor, data in submissions.items():
+            for student_key, records in data.get("students", {}).items():
+                for record in records:
+                    self.add_submission(professor, student_key, record)
+
+    def is_backfilled(self):
+        """Whether submissions saved before the index existed have been added."""
+        return self._conn().execute("SELECT 1 FROM meta WHERE key = 'backfilled'").fetchone() is not None
+
+    def mark_backfilled(self):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('backfilled', '1')")
+
+    def search(self, professor, terms, chatbot_name=None, role=None, limit=50):
+        """
+        Find messages for a professor containing any of `terms`.
+        Returns a list of hits with a highlighted snippet, best matches first.
+        """
+        expression = _match_expression(terms)
+        if not expression:
+            return []
+
+        sql = (
+            "SELECT student_key, student_name, chatbot_name, timestamp, user_token, role, "
+            "snippet(messages, 0, ?, ?, '…', 24) "
+            "FROM messages WHERE messages MATCH ? AND professor = ?"
+        )
+        params = [SNIPPET_START, SNIPPET_END, expression, professor.lower()]
+        if chatbot_name:
+            sql += " AND chatbot_name = ?"
+            params.append(chatbot_name)
+        if role:
+            sql += " AND role = ?"
+            params.append(role)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+
+        hits = []
+        for student_key, student_name, chatbot, timestamp, user_token, msg_role, snippet in self._conn().execute(sql, params):
+            hits.append({
+                "student_key": student_key,
+                "student_name": student_name,
+                "chatbot_name": chatbot,
+                "timestamp": timestamp,
+                "user_token": user_token,
+                "role": msg_role,
+                # Escape the message text, then turn the match markers into highlight tags
+                "snippet": html.escape(_unsegment(snippet)).replace(SNIPPET_START, "<b>").replace(SNIPPET_END, "</b>"),
+            })
+        return hits
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """Return the conversation search index, creating it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex(Config.SEARCH_INDEX_PATH)
+    return _index
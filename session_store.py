@@ -0,0 +1,223 @@
+import json
+import sqlite3
+import threading
+import time
+from config import Config
+
+
+def new_conversation(chatbot=None, language=None, prompt=None, prompt_version=None):
+    """
+    Create a conversation record.
+    recent_lines is None until the history has been loaded once; after that it
+    holds the last CUTOFF_LINE_INDEX history lines so turns do not re-read the file.
+    """
+    return {
+        "chatbot": chatbot,
+        "language": language,
+        "prompt": prompt,
+        "prompt_version": prompt_version,
+        "recent_lines": None,
+        "turns": 0,
+    }
+
+
+class MemoryBackend:
+    """
+    Per-process dictionary store. Only for a single worker process or development:
+    with several processes each one caches its own recent lines and misses turns
+    handled by the others.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    def _prune(self, now):
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        expired = [token for token, (expires, _) in self._data.items() if expires < now]
+        for token in expired:
+            del self._data[token]
+
+    def get(self, token):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            entry = self._data.get(token)
+            if not entry or entry[0] < now:
+                return None
+            # Hand out a copy so callers never mutate the stored record in place
+            return json.loads(entry[1])
+
+    def set(self, token, record):
+        with self._lock:
+            self._data[token] = (time.monotonic() + self.ttl, json.dumps(record, ensure_ascii=False))
+
+    def update(self, token, mutate):
+        """Atomically replace a record with mutate(current record or None); returns the new record."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(token)
+            record = mutate(json.loads(entry[1]) if entry and entry[0] >= now else None)
+            self._data[token] = (now + self.ttl, json.dumps(record, ensure_ascii=False))
+            return record
+
+    def delete(self, token):
+        with self._lock:
+            self._data.pop(token, None)
+
+
+class SQLiteBackend:
+    """Shared store for several worker processes on one host."""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "token TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, token):
+        row = self._conn().execute(
+            "SELECT data FROM conversations WHERE token = ? AND expires >= ?", (token, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, token, record):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO conversations (token, data, expires) VALUES (?, ?, ?)",
+            (token, json.dumps(record, ensure_ascii=False), now + self.ttl),
+        )
+        # Opportunistically drop expired rows instead of running a separate job
+        conn.execute("DELETE FROM conversations WHERE expires < ?", (now,))
+        conn.commit()
+
+    def update(self, token, mutate):
+        conn = self._conn()
+        now = time.time()
+        # Take the write lock before reading so concurrent updates are applied one after another
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM conversations WHERE token = ? AND expires >= ?", (token, now)
+            ).fetchone()
+            record = mutate(json.loads(row[0]) if row else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations (token, data, expires) VALUES (?, ?, ?)",
+                (token, json.dumps(record, ensure_ascii=False), now + self.ttl),
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return record
+
+    def delete(self, token):
+        conn = self._conn()
+        conn.execute("DELETE FROM conversations WHERE token = ?", (token,))
+        conn.commit()
+
+
+class RedisBackend:
+    """Store for a local Redis (or Redis-compatible) server. Requires the `redis` package."""
+
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package (pip install redis)")
+        self.ttl = int(ttl)
+        self._client = redis.Redis.from_url(url)
+        self._WatchError = redis.WatchError
+
+    def _key(self, token):
+        return f"conversation:{token}"
+
+    def get(self, token):
+        data = self._client.get(self._key(token))
+        return json.loads(data) if data else None
+
+    def set(self, token, record):
+        self._client.setex(self._key(token), self.ttl, json.dumps(record, ensure_ascii=False))
+
+    def update(self, token, mutate):
+        key = self._key(token)
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    # WATCH makes EXEC fail if another client changed the key in between
+                    pipe.watch(key)
+                    data = pipe.get(key)
+                    record = mutate(json.loads(data) if data else None)
+                    pipe.multi()
+                    pipe.setex(key, self.ttl, json.dumps(record, ensure_ascii=False))
+                    pipe.execute()
+                    return record
+                except self._WatchError:
+                    continue
+
+    def delete(self, token):
+        self._client.delete(self._key(token))
+
+
+def record_turn(token, conversation, new_lines):
+    """
+    Save a finished turn. `conversation` is this request's copy of the record with
+    `new_lines` already added. Other requests for the same token may have saved
+    turns since it was read, so the lines are appended to the stored record
+    atomically instead of overwriting it. `conversation` is updated to match.
+    """
+    def mutate(stored):
+        if stored is None or stored.get("recent_lines") is None:
+            # Nothing cached yet: this request's lines were seeded from the history file
+            stored = stored or new_conversation()
+            stored["recent_lines"] = conversation["recent_lines"]
+            stored["turns"] = conversation["turns"]
+        else:
+            stored["recent_lines"] = (stored["recent_lines"] + new_lines)[-Config.CUTOFF_LINE_INDEX:]
+            stored["turns"] += 1
+        for field in ("chatbot", "language", "prompt", "prompt_version"):
+            stored[field] = conversation[field]
+        return stored
+
+    conversation.update(get_store().update(token, mutate))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the configured conversation store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = Config.SESSION_BACKEND
+                if backend == "sqlite":
+                    _store = SQLiteBackend(Config.SESSION_DB_PATH, Config.SESSION_TTL_SECONDS)
+                elif backend == "redis":
+                    _store = RedisBackend(Config.SESSION_REDIS_URL, Config.SESSION_TTL_SECONDS)
+                elif backend == "memory":
+                    _store = MemoryBackend(Config.SESSION_TTL_SECONDS)
+                else:
+                    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+    return _store
@@ -0,0 +1,205 @@
+import os
+import json
+import importlib.util
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import Config
+from clients import get_openai_client
+
+
+class SpeechBackend:
+    """
+    Interface for speech engines.
+    transcribe() returns (text spoken in an audio file, audio duration in seconds or None).
+    synthesize() writes speech audio for `text` to `out_path`.
+    """
+    name = None
+    audio_extension = "mp3"
+    transcription_model = None
+    tts_model = None
+
+    def transcribe(self, file_path, language_code):
+        raise NotImplementedError
+
+    def synthesize(self, text, voice, language, out_path):
+        raise NotImplementedError
+
+
+class OpenAISpeechBackend(SpeechBackend):
+    """Hosted whisper-1 transcription and tts-1 speech."""
+    name = "openai"
+    audio_extension = "mp3"
+    transcription_model = "whisper-1"
+    tts_model = "tts-1"
+
+    def transcribe(self, file_path, language_code):
+        with open(file_path, "rb") as audio_file:
+            transcription = get_openai_client().audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                language=language_code,
+                response_format="verbose_json"  # includes the billed duration
+            )
+        return transcription.text, getattr(transcription, "duration", None)
+
+    def synthesize(self, text, voice, language, out_path):
+        with get_openai_client().audio.speech.with_streaming_response.create(
+            model="tts-1",
+            voice=voice,
+            input=text
+        ) as response:
+            response.stream_to_file(out_path)
+
+
+# --- Local engine: runs inside worker processes ---
+
+_worker_model = None
+
+
+def _init_worker(model_name):
+    """Load the Whisper model once per worker process and keep it in memory."""
+    global _worker_model
+    import whisper
+    started = time.perf_counter()
+    _worker_model = whisper.load_model(model_name, device="cpu")
+    print(f"Local Whisper model '{model_name}' loaded in {time.perf_counter() - started:.1f}s (pid {os.getpid()})")
+
+
+def _transcribe_local(file_path, language_code):
+    """Transcribe one recording with the already loaded model. Returns (text, seconds)."""
+    import whisper
+    audio = whisper.load_audio(file_path)
+    result = _worker_model.transcribe(audio, language=language_code, fp16=False)
+    return result["text"].strip(), len(audio) / whisper.audio.SAMPLE_RATE
+
+
+def _synthesize_local(text, language, out_path):
+    import pyttsx3
+    engine = pyttsx3.init()
+    # Prefer an installed voice matching the chatbot language
+    if language:
+        for voice in engine.getProperty("voices"):
+            if language.lower() in (voice.name or "").lower():
+                engine.setProperty("voice", voice.id)
+                break
+    engine.save_to_file(text, out_path)
+    engine.runAndWait()
+
+
+class LocalSpeechBackend(SpeechBackend):
+    """
+    CPU Whisper transcription (openai-whisper package) and optional offline TTS (pyttsx3).
+    Work runs in a process pool whose workers keep the model loaded, one recording
+    per worker at a time. A pool whose workers died (for example because the model
+    could not be loaded) is replaced on the next request.
+    """
+    name = "local"
+    audio_extension = "wav"
+    tts_model = "local-pyttsx3"
+
+    def __init__(self, model_name, workers, timeout):
+        self.model_name = model_name
+        self.transcription_model = f"local-whisper-{model_name}"
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = None
+        self._tts_pool = None
+        self._lock = threading.Lock()
+
+    def _transcription_pool(self):
+        # Workers are only spawned once the first transcription arrives
+        with self._lock:
+            if self._pool is None:
+                if importlib.util.find_spec("whisper") is None:
+                    raise RuntimeError("Local transcription requires the 'openai-whisper' package (pip install openai-whisper)")
+                # spawn, not fork: the web server process is multi-threaded
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name,),
+                )
+            return self._pool
+
+    def _synthesis_pool(self):
+        with self._lock:
+            if self._tts_pool is None:
+                if importlib.util.find_spec("pyttsx3") is None:
+                    raise RuntimeError("Local TTS requires the 'pyttsx3' package (pip install pyttsx3)")
+                self._tts_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+            return self._tts_pool
+
+    def _discard_pool(self, attribute, pool):
+        """Drop a broken pool so the next request starts fresh workers."""
+        with self._lock:
+            if getattr(self, attribute) is pool:
+                setattr(self, attribute, None)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, attribute, get_pool, fn, *args):
+        pool = get_pool()
+        try:
+            # Raises BrokenProcessPool, or RuntimeError once the pool was shut down
+            future = pool.submit(fn, *args)
+        except RuntimeError as e:
+            self._discard_pool(attribute, pool)
+            raise RuntimeError(f"Local speech engine unavailable: {e}") from e
+        try:
+            return future.result(timeout=self.timeout)
+        except BrokenProcessPool as e:
+            self._discard_pool(attribute, pool)
+            raise RuntimeError(f"Local speech engine failed: {e}") from e
+        except TimeoutError:
+            future.cancel()
+            raise RuntimeError(f"Local speech engine did not finish within {self.timeout:g}s")
+
+    def transcribe(self, file_path, language_code):
+        return self._run("_pool", self._transcription_pool, _transcribe_local, file_path, language_code)
+
+    def synthesize(self, text, voice, language, out_path):
+        self._run("_tts_pool", self._synthesis_pool, _synthesize_local, text, language, out_path)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def _get_backend(name):
+    with _backends_lock:
+        if name not in _backends:
+            if name == "openai":
+                _backends[name] = OpenAISpeechBackend()
+            elif name == "local":
+                _backends[name] = LocalSpeechBackend(
+                    Config.LOCAL_WHISPER_MODEL,
+                    Config.LOCAL_SPEECH_WORKERS,
+                    Config.LOCAL_SPEECH_TIMEOUT,
+                )
+            else:
+                raise ValueError(f"Unknown speech backend: {name}")
+        return _backends[name]
+
+
+def _backend_name_for(routing_env, language):
+    """Read a {"default": ..., "<language>": ...} routing map from the environment."""
+    routing_json = os.getenv(routing_env)
+    if routing_json:
+        try:
+            routing = json.loads(routing_json)
+            return routing.get(language, routing.get("default", "openai"))
+        except json.JSONDecodeError as e:
+            print(f"Error decoding {routing_env} from .env: {e}")
+    return "openai"
+
+
+def get_transcriber(language):
+    """Speech-to-text backend configured for a chatbot language (TRANSCRIPTION_BACKENDS)."""
+    return _get_backend(_backend_name_for("TRANSCRIPTION_BACKENDS", language))
+
+
+def get_synthesizer(language):
+    """Text-to-speech backend configured for a chatbot language (TTS_BACKENDS)."""
+    return _get_backend(_backend_name_for("TTS_BACKENDS", language))
@@ -0,0 +1,357 @@
+import os
+import io
+import json
+import time
+import random
+import fcntl
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from config import Config, BASE_DIR
+
+# Keys are relative paths, laid out like the project directory, so the local
+# backend keeps using the existing files.
+HISTORY_PREFIX = "conversation_history/"
+AUDIO_PREFIX = "audio_files/"
+SUBMISSIONS_KEY = "submissions.json"
+
+# Read once at import: os.umask can only be read by setting it, which is not thread-safe
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def history_key(user_token):
+    return f"{HISTORY_PREFIX}chat_history{user_token}.txt"
+
+
+def audio_key(filename):
+    return f"{AUDIO_PREFIX}{filename}"
+
+
+class StorageConflictError(Exception):
+    """Raised by write_if when the object changed since it was read."""
+
+
+class LocalStorage:
+    """Files under the project directory. Single node only."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def filesystem_path(self, key):
+        """Path of the object on disk, so it can be served without copying."""
+        return self._path(key)
+
+    def read(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _replace(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # mkstemp creates the file as 0600; keep the permissions a plain open() would give
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+            else:
+                os.chmod(tmp_path, 0o666 & ~_UMASK)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def write(self, key, data):
+        self._replace(self._path(key), data)
+
+    def append(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(data)
+
+    def save_file(self, key, local_path):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        """Return (key, modified timestamp) for every object under prefix."""
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        return [
+            (prefix + entry.name, entry.stat().st_mtime)
+            for entry in os.scandir(directory)
+            if entry.is_file() and not entry.name.startswith(".")
+        ]
+
+    @contextmanager
+    def _key_lock(self, path):
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _version(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return f"{st.st_mtime_ns}-{st.st_size}-{st.st_ino}"
+
+    def read_versioned(self, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._key_lock(path):
+            return self.read(key), self._version(path)
+
+    def write_if(self, key, data, version):
+        """Write only if the object is still at `version` (None: must not exist)."""
+        path = self._path(key)
+        with self._key_lock(path):
+            if self._version(path) != version:
+                raise StorageConflictError(key)
+            self._replace(path, data)
+
+
+class SQLiteStorage:
+    """Objects stored as blobs in one SQLite database. Shared by processes on one host,
+    or across hosts if the database lives on a filesystem with working locks."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "key TEXT PRIMARY KEY, data BLOB NOT NULL, version INTEGER NOT NULL, mtime REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def filesystem_path(self, key):
+        return None
+
+    def read(self, key):
+        row = self._conn().execute("SELECT data FROM objects WHERE key = ?", (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write(self, key, data):
+        self._conn().execute(
+            "INSERT INTO objects (key, data, version, mtime) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, version = version + 1, mtime = excluded.mtime",
+            (key, data, time.time()),
+        )
+
+    def append(self, key, data):
+        self._conn().execute(
+            "INSERT INTO objects (key, data, version, mtime) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = CAST(data || excluded.data AS BLOB), version = version + 1, mtime = excluded.mtime",
+            (key, data, time.time()),
+        )
+
+    def save_file(self, key, local_path):
+        with open(local_path, "rb") as f:
+            self.write(key, f.read())
+
+    def exists(self, key):
+        return self._conn().execute("SELECT 1 FROM objects WHERE key = ?", (key,)).fetchone() is not None
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM objects WHERE key = ?", (key,))
+
+    def list(self, prefix):
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return self._conn().execute(
+            "SELECT key, mtime FROM objects WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",)
+        ).fetchall()
+
+    def read_versioned(self, key):
+        row = self._conn().execute("SELECT data, version FROM objects WHERE key = ?", (key,)).fetchone()
+        return (bytes(row[0]), row[1]) if row else (None, None)
+
+    def write_if(self, key, data, version):
+        conn = self._conn()
+        if version is None:
+            try:
+                conn.execute(
+                    "INSERT INTO objects (key, data, version, mtime) VALUES (?, ?, 1, ?)", (key, data, time.time())
+                )
+            except sqlite3.IntegrityError:
+                raise StorageConflictError(key)
+            return
+        cursor = conn.execute(
+            "UPDATE objects SET data = ?, version = version + 1, mtime = ? WHERE key = ? AND version = ?",
+            (data, time.time(), key, version),
+        )
+        if cursor.rowcount == 0:
+            raise StorageConflictError(key)
+
+
+class S3Storage:
+    """
+    S3-compatible object store (AWS S3, MinIO, ...). Requires boto3.
+    Objects cannot be appended to, so append and write_if use conditional
+    writes (If-Match / If-None-Match) and retry when another node got there first.
+    """
+
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the 'boto3' package (pip install boto3)")
+        self._client = boto3.client("s3", endpoint_url=endpoint_url or None)
+        self._ClientError = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _error_code(self, error):
+        return error.response.get("Error", {}).get("Code")
+
+    def filesystem_path(self, key):
+        return None
+
+    def read(self, key):
+        return self.read_versioned(key)[0]
+
+    def read_versioned(self, key):
+        try:
+            obj = self._client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self._ClientError as e:
+            if self._error_code(e) in ("NoSuchKey", "404"):
+                return None, None
+            raise
+        return obj["Body"].read(), obj["ETag"]
+
+    def write(self, key, data):
+        self._client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def write_if(self, key, data, version):
+        conditions = {"IfNoneMatch": "*"} if version is None else {"IfMatch": version}
+        try:
+            self._client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, **conditions)
+        except self._ClientError as e:
+            if self._error_code(e) in ("PreconditionFailed", "412", "ConditionalRequestConflict", "409"):
+                raise StorageConflictError(key)
+            raise
+
+    def append(self, key, data):
+        for attempt in range(10):
+            existing, version = self.read_versioned(key)
+            try:
+                self.write_if(key, (existing or b"") + data, version)
+                return
+            except StorageConflictError:
+                # Back off a little so competing writers stop colliding
+                time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+        raise StorageConflictError(key)
+
+    def save_file(self, key, local_path):
+        self._client.upload_file(local_path, self.bucket, self.prefix + key)
+
+    def exists(self, key):
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except self._ClientError as e:
+            if self._error_code(e) in ("NoSuchKey", "404", "NotFound"):
+                return False
+            raise
+
+    def delete(self, key):
+        self._client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list(self, prefix):
+        results = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for obj in page.get("Contents", []):
+                results.append((obj["Key"][len(self.prefix):], obj["LastModified"].timestamp()))
+        return results
+
+
+def update_json(storage, key, mutate, retries=10):
+    """
+    Read-modify-write a JSON object without losing concurrent updates from other
+    processes or nodes: `mutate` is re-applied to fresh data if the write races.
+    A missing, empty or corrupt object starts as {}. Returns what `mutate` returns.
+    """
+    for _ in range(retries):
+        data, version = storage.read_versioned(key)
+        try:
+            document = json.loads(data) if data else {}
+        except json.JSONDecodeError:
+            document = {}
+        result = mutate(document)
+        try:
+            storage.write_if(key, json.dumps(document, indent=2).encode("utf-8"), version)
+            return result
+        except StorageConflictError:
+            continue
+    raise StorageConflictError(key)
+
+
+def open_for_send(storage, key):
+    """Return something Flask's send_file accepts: a path for local files, else an in-memory buffer."""
+    path = storage.filesystem_path(key)
+    if path:
+        return path if os.path.exists(path) else None
+    data = storage.read(key)
+    return io.BytesIO(data) if data is not None else None
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the configured storage backend (STORAGE_BACKEND), creating it on first use."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = Config.STORAGE_BACKEND
+                if backend == "local":
+                    _storage = LocalStorage(BASE_DIR)
+                elif backend == "sqlite":
+                    _storage = SQLiteStorage(Config.STORAGE_SQLITE_PATH)
+                elif backend == "s3":
+                    _storage = S3Storage(Config.S3_BUCKET, Config.S3_PREFIX, Config.S3_ENDPOINT_URL)
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return _storage
@@ -0,0 +1,164 @@
+"""
+S3Storage against an in-memory stand-in for an S3-compatible server.
+
+The stand-in implements the handful of client calls S3Storage uses, including
+conditional puts (IfMatch / IfNoneMatch) answered with 412 PreconditionFailed,
+so the compare-and-swap paths run without AWS or MinIO.
+"""
+import os
+import sys
+import json
+import types
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import S3Storage, StorageConflictError, update_json
+
+
+class ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket, Key):
+        with self._lock:
+            if Key not in self.objects:
+                raise ClientError("NoSuchKey")
+            data, etag, _ = self.objects[Key]
+        return {"Body": types.SimpleNamespace(read=lambda: data), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None):
+        with self._lock:
+            current = self.objects.get(Key)
+            if IfNoneMatch == "*" and current is not None:
+                raise ClientError("PreconditionFailed")
+            if IfMatch is not None and (current is None or current[1] != IfMatch):
+                raise ClientError("PreconditionFailed")
+            etag = '"%s"' % hashlib.md5(Body).hexdigest()
+            self.objects[Key] = (Body, etag, datetime.now(timezone.utc))
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, "rb") as f:
+            self.put_object(Bucket, Key, f.read())
+
+    def head_object(self, Bucket, Key):
+        with self._lock:
+            if Key not in self.objects:
+                raise ClientError("404")
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self.objects.pop(Key, None)
+
+    def get_paginator(self, name):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                with client._lock:
+                    contents = [{"Key": key, "LastModified": modified}
+                                for key, (_, _, modified) in client.objects.items() if key.startswith(Prefix)]
+                yield {"Contents": contents}
+
+        return Paginator()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3Client()
+    fake_boto3 = types.ModuleType("boto3")
+    fake_boto3.client = lambda service, endpoint_url=None: client
+    fake_exceptions = types.ModuleType("botocore.exceptions")
+    fake_exceptions.ClientError = ClientError
+    monkeypatch.setitem(sys.modules, "boto3", fake_boto3)
+    monkeypatch.setitem(sys.modules, "botocore", types.ModuleType("botocore"))
+    monkeypatch.setitem(sys.modules, "botocore.exceptions", fake_exceptions)
+    backend = S3Storage("bucket", prefix="test/", endpoint_url="http://localhost:9000")
+    backend.fake_client = client
+    return backend
+
+
+def test_read_write_and_prefix(s3):
+    assert s3.read("a.txt") is None
+    assert s3.read_versioned("a.txt") == (None, None)
+    s3.write("a.txt", b"hello")
+    assert s3.read("a.txt") == b"hello"
+    assert s3.exists("a.txt")
+    assert "test/a.txt" in s3.fake_client.objects
+    assert [key for key, _ in s3.list("a")] == ["a.txt"]
+    s3.delete("a.txt")
+    assert not s3.exists("a.txt")
+
+
+def test_write_if_conflicts(s3):
+    s3.write_if("doc.json", b"1", None)
+    with pytest.raises(StorageConflictError):
+        s3.write_if("doc.json", b"2", None)  # If-None-Match: * on an existing object
+
+    data, version = s3.read_versioned("doc.json")
+    s3.write("doc.json", b"changed elsewhere")
+    with pytest.raises(StorageConflictError):
+        s3.write_if("doc.json", b"3", version)  # If-Match with a stale ETag
+
+    data, version = s3.read_versioned("doc.json")
+    s3.write_if("doc.json", b"4", version)
+    assert s3.read("doc.json") == b"4"
+
+
+@pytest.mark.parametrize("code", ["PreconditionFailed", "412", "ConditionalRequestConflict", "409"])
+def test_write_if_maps_conflict_codes(s3, monkeypatch, code):
+    def put_object(**kwargs):
+        raise ClientError(code)
+    monkeypatch.setattr(s3.fake_client, "put_object", put_object)
+    with pytest.raises(StorageConflictError):
+        s3.write_if("doc.json", b"x", None)
+
+
+def test_write_if_reraises_other_errors(s3, monkeypatch):
+    def put_object(**kwargs):
+        raise ClientError("AccessDenied")
+    monkeypatch.setattr(s3.fake_client, "put_object", put_object)
+    with pytest.raises(ClientError):
+        s3.write_if("doc.json", b"x", None)
+
+
+def test_concurrent_append_keeps_every_line(s3):
+    def writer(n):
+        for i in range(20):
+            s3.append("history.txt", f"{n}-{i}\n".encode())
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    lines = s3.read("history.txt").decode().splitlines()
+    assert sorted(lines) == sorted(f"{n}-{i}" for n in range(8) for i in range(20))
+
+
+def test_update_json_concurrent(s3):
+    def increment(document):
+        document["n"] = document.get("n", 0) + 1
+
+    threads = [
+        threading.Thread(target=lambda: [update_json(s3, "counter.json", increment, retries=1000) for _ in range(20)])
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert json.loads(s3.read("counter.json")) == {"n": 160}
@@ -0,0 +1,67 @@
+import os
+import hashlib
+import json
+import tempfile
+import threading
+import time
+from speech_backends import get_synthesizer
+from usage_utils import record_usage
+from storage import get_storage, audio_key
+
+DEFAULT_VOICE = "alloy"
+
+
+def voice_for_language(language):
+    """Pick the configured TTS voice for a chatbot language, falling back to the default."""
+    voices_json = os.getenv("TTS_LANGUAGE_VOICES")
+    if voices_json:
+        try:
+            voices = json.loads(voices_json)
+            return voices.get(language, DEFAULT_VOICE)
+        except json.JSONDecodeError as e:
+            print(f"Error decoding TTS_LANGUAGE_VOICES from .env: {e}")
+    return DEFAULT_VOICE
+
+
+def tts_cache_filename(text, voice, language=None):
+    """
+    Content-addressed filename for a piece of TTS audio.
+    The same text, voice and speech backend always map to the same file, so audio
+    generated ahead of time by pregenerate_tts.py is reused by the /tts route.
+    """
+    backend = get_synthesizer(language)
+    digest = hashlib.sha256(f"{backend.name}\0{voice}\0{text}".encode("utf-8")).hexdigest()
+    return f"tts_{digest[:32]}.{backend.audio_extension}"
+
+
+def generate_tts_audio(text, voice=DEFAULT_VOICE, language=None):
+    """Generate TTS audio with the speech backend for the language, reusing cached audio when available."""
+    try:
+        audio_filename = tts_cache_filename(text, voice, language)
+        storage = get_storage()
+
+        if storage.exists(audio_key(audio_filename)):
+            return audio_filename
+
+        # Synthesize to a local temporary file and store it only once complete, so an
+        # interrupted request never leaves a partial file that later looks like a cache hit
+        tmp_filepath = os.path.join(tempfile.gettempdir(), f"{audio_filename}.{os.getpid()}.{threading.get_ident()}.part")
+        synthesizer = get_synthesizer(language)
+        started = time.monotonic()
+        try:
+            synthesizer.synthesize(text, voice, language, tmp_filepath)
+            storage.save_file(audio_key(audio_filename), tmp_filepath)
+        finally:
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+        record_usage(
+            "tts", synthesizer.tts_model, language=language, characters=len(text),
+            latency_ms=round((time.monotonic() - started) * 1000),
+        )
+
+        if storage.exists(audio_key(audio_filename)):
+            return audio_filename
+        return None
+    except Exception as e:
+        print(f"ERROR TTS: {str(e)}")
+        return None
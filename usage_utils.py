@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from config import Config
+
+# Short keys keep each log line small; see record_usage for their meaning.
+_NUMERIC_FIELDS = {"in": "input_tokens", "out": "output_tokens", "ms": "latency_ms", "ch": "characters", "s": "audio_seconds",
+                   "h": "hedged_calls"}
+GROUP_FIELDS = ("day", "kind", "model", "chatbot", "language")
+
+
+def record_usage(kind, model, chatbot=None, language=None, input_tokens=None, output_tokens=None,
+                 latency_ms=None, characters=None, audio_seconds=None, hedged=False):
+    """
+    Append one upstream call to the usage log.
+    kind is 'completion', 'transcription' or 'tts'; hedged marks a duplicate
+    request sent by the resilience layer. Never raises: usage accounting must
+    not break a student's request.
+    """
+    entry = {"t": int(time.time()), "k": kind, "m": model, "c": chatbot, "l": language,
+             "in": input_tokens, "out": output_tokens, "ms": latency_ms, "ch": characters, "s": audio_seconds,
+             "h": 1 if hedged else None}
+    line = json.dumps({k: v for k, v in entry.items() if v is not None}, ensure_ascii=False, separators=(",", ":")) + "\n"
+    try:
+        # A single O_APPEND write keeps lines intact across worker processes
+        fd = os.open(Config.USAGE_LOG_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"Error writing usage log: {e}")
+
+
+class UsageAggregator:
+    """
+    Per-day aggregates of the usage log. Only lines appended since the last
+    query are read, so queries stay cheap as the log grows.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._offset = 0
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self._offset:
+            # Log was rotated or truncated; start over
+            self._offset = 0
+            self._totals = {}
+        if size == self._offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Leave a partially written last line for the next refresh
+        end = data.rfind(b"\n") + 1
+        self._offset += end
+
+        for raw in data[:end].splitlines():
+            try:
+                entry = json.loads(raw)
+            except ValueError:
+                continue
+            key = (
+                datetime.fromtimestamp(entry["t"]).strftime("%Y-%m-%d"),
+                entry.get("k"), entry.get("m"), entry.get("c"), entry.get("l"),
+            )
+            totals = self._totals.setdefault(key, dict.fromkeys(["calls", *_NUMERIC_FIELDS.values()], 0))
+            totals["calls"] += 1
+            for short, name in _NUMERIC_FIELDS.items():
+                if short in entry:
+                    totals[name] += entry[short]
+
+    def query(self, group_by=GROUP_FIELDS, start=None, end=None):
+        """Sum the daily aggregates over [start, end] (YYYY-MM-DD), grouped by the given fields."""
+        indexes = [GROUP_FIELDS.index(field) for field in group_by]
+        grouped = {}
+        with self._lock:
+            self._refresh()
+            for key, totals in self._totals.items():
+                if (start and key[0] < start) or (end and key[0] > end):
+                    continue
+                group = tuple(key[i] for i in indexes)
+                target = grouped.setdefault(group, dict.fromkeys(totals, 0))
+                for name, value in totals.items():
+                    target[name] += value
+
+        rows = []
+        for group, totals in sorted(grouped.items(), key=lambda item: tuple(str(v) for v in item[0])):
+            row = dict(zip(group_by, group))
+            row.update(totals)
+            row["audio_seconds"] = round(row["audio_seconds"], 1)
+            row["avg_latency_ms"] = round(row["latency_ms"] / row["calls"]) if row["calls"] else 0
+            rows.append(row)
+        return rows
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_usage_aggregator():
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = UsageAggregator(Config.USAGE_LOG_FILE)
+    return _aggregator
@@ -8,6 +8,18 @@ project_home = os.path.dirname(__file__)
 if project_home not in sys.path:
     sys.path.insert(0, project_home)
 
+import time
+_startup_started = time.perf_counter()
+
+# Validate configuration on startup so a misconfigured deploy fails fast.
+# This lives here rather than in app.py so the app can be imported without every secret.
+from config import Config
+Config.validate_required_configs()
+
 # Import the Flask app object from your app.py file
 # The 'application' variable is what WSGI servers like mod_wsgi look for by default.
 from app import app as application
+from clients import ensure_directories
+ensure_directories()
+
+print(f"Startup completed in {(time.perf_counter() - _startup_started) * 1000:.0f} ms", file=sys.stderr)